@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import contextlib
+import importlib.machinery
+import importlib.util
+import json
+import os
+import queue
+import socket
+from datetime import datetime, timezone
+
+# pip install starlette uvicorn asyncpg a2wsgi python-multipart
+import asyncpg
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from uvicorn.supervisors import Multiprocess
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+ASGI_CONFIG = {
+    "host": "0.0.0.0",
+    "port": 5000,
+    "workers": 4,           # server processes
+    "db_min_size": 2,
+    "db_max_size": 10,
+    "wsgi_threads": 10      # threads serving the routes that stay on Flask
+}
+
+
+def load_flask_module():
+    # The Flask app lives in a file called "Flask", which import can't reach
+    path = os.path.join(HERE, "Flask")
+    loader = importlib.machinery.SourceFileLoader("liquid_flask", path)
+    spec = importlib.util.spec_from_loader(loader.name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+flask_app = load_flask_module()
+db_pool = None
+
+
+async def api_telemetry(request):
+    try:
+        data = json.loads(await request.body())
+    except ValueError:
+        return JSONResponse({"ok": False, "error": "invalid JSON"}, status_code=400)
+    if not isinstance(data, dict):
+        return JSONResponse({"ok": False, "error": "expected a JSON object"}, status_code=400)
+
+    row = (data.get("source", "unknown"), data, datetime.now(timezone.utc))
+
+    # Always buffered here: the writer thread does the INSERT, so the event
+    # loop never waits on Postgres for telemetry
+    try:
+        flask_app.get_writer().submit(row)
+    except queue.Full:
+        return JSONResponse({"ok": False, "error": "ingest queue full"}, status_code=429)
+    flask_app.telemetry_hub.publish([row])
+
+    return JSONResponse({"ok": True, "queued": True}, status_code=202)
+
+
+async def send_command(request):
+    form = await request.form()
+    try:
+        target = form["target"]
+        command = form["command"]
+        payload = json.loads(form["payload"])
+    except (KeyError, ValueError) as e:
+        return PlainTextResponse(f"Bad command: {e}", status_code=400)
+
+    async with db_pool.acquire() as conn:
+        await conn.execute(
+            "INSERT INTO commands (target, command, payload) VALUES ($1, $2, $3)",
+            target, command, json.dumps(payload)
+        )
+    flask_app.view_cache.invalidate("commands")
+
+    return HTMLResponse("Command sent. <a href='/dashboard'>Back</a>")
+
+
+async def api_stream(request):
+    # Served here rather than by Flask: a stream held open on the WSGI
+    # thread pool would keep one of its threads for as long as the client
+    # stays, and a handful of dashboards would starve every other route
+    loop = asyncio.get_running_loop()
+    wake = asyncio.Event()
+    sub = flask_app.telemetry_hub.subscribe(
+        request.query_params.get("source"),
+        notify=lambda: loop.call_soon_threadsafe(wake.set)
+    )
+    if sub is None:
+        return JSONResponse({"ok": False, "error": "too many stream clients"}, status_code=503)
+
+    async def events():
+        try:
+            yield "retry: 2000\n\n"
+            while not sub.dropped:
+                wake.clear()
+                try:
+                    event = sub.queue.get_nowait()
+                except queue.Empty:
+                    try:
+                        await asyncio.wait_for(wake.wait(), flask_app.STREAM_CONFIG["keepalive"])
+                    except asyncio.TimeoutError:
+                        yield ": keepalive\n\n"
+                    continue
+                yield f"event: telemetry\ndata: {event}\n\n"
+        finally:
+            flask_app.telemetry_hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    global db_pool
+
+    # Opening the psycopg2 pool applies the migrations before the first request
+    await asyncio.to_thread(flask_app.get_pool)
+    config = flask_app.DB_CONFIG
+    db_pool = await asyncpg.create_pool(
+        database=config["dbname"],
+        user=config["user"],
+        password=config["password"],
+        host=config["host"],
+        min_size=ASGI_CONFIG["db_min_size"],
+        max_size=ASGI_CONFIG["db_max_size"]
+    )
+    try:
+        yield
+    finally:
+        await db_pool.close()
+        await asyncio.to_thread(flask_app.stop_writer)
+
+
+app = Starlette(
+    routes=[
+        Route("/api/telemetry", api_telemetry, methods=["POST"]),
+        Route("/send-command", send_command, methods=["POST"]),
+        Route("/api/stream", api_stream),
+        # Everything else (dashboard, history, series, bulk) is served by the
+        # Flask app on a thread pool
+        Mount("/", app=WSGIMiddleware(flask_app.app, workers=ASGI_CONFIG["wsgi_threads"])),
+    ],
+    lifespan=lifespan
+)
+
+
+class Config(uvicorn.Config):
+
+    def bind_socket(self):
+        # With several workers uvicorn binds the socket itself, without the
+        # TCP proto asyncio looks for before it disables Nagle. Set it here so
+        # accepted connections inherit it; otherwise keep-alive responses stall
+        # ~40 ms on delayed ACKs.
+        sock = super().bind_socket()
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the liquid system app with uvicorn")
+    parser.add_argument("--host", default=ASGI_CONFIG["host"])
+    parser.add_argument("--port", type=int, default=ASGI_CONFIG["port"])
+    parser.add_argument("--workers", type=int, default=ASGI_CONFIG["workers"])
+    args = parser.parse_args()
+
+    config = Config("asgi:app", host=args.host, port=args.port, workers=args.workers)
+    if config.workers > 1:
+        Multiprocess(config, sockets=[config.bind_socket()]).run()
+    else:
+        uvicorn.Server(config).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# Size and speed of the binary telemetry frames (esp32-1/telemetry.py, decoded
+# by the Flask ingest path) against the per-topic JSON messages they replace.
+# Sizes are counted three ways: payload, MQTT PUBLISH packet (QoS 0) and the
+# ESP-NOW frame on air. Encode/decode rates are CPython, so only the ratio
+# says something about the ESP32.
+#
+#   python bench/bench_frames.py --samples 20000 --probes 2
+
+import argparse
+import importlib.machinery
+import importlib.util
+import json
+import os
+import random
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, os.pardir)
+
+ESPNOW_OVERHEAD = 43     # MAC header, action frame fields, vendor element and FCS
+
+JSON_TOPICS = {
+    "water_level": "liquid_system/level",
+    "temperature": "liquid_system/temperature",
+    "laser_beam_broken": "liquid_system/laser",
+}
+FRAME_TOPIC = "liquid_system/telemetry"
+
+
+def load_module(name, path):
+    loader = importlib.machinery.SourceFileLoader(name, path)
+    spec = importlib.util.spec_from_loader(name, loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def mqtt_size(topic, payload):
+    remaining = 2 + len(topic) + len(payload)
+    return 1 + (1 if remaining < 128 else 2) + remaining
+
+
+def make_samples(count, probes, seed=0):
+    rng = random.Random(seed)
+    roms = [bytes([0x28, 0xff] + [rng.randrange(256) for _ in range(5)] + [i]) for i in range(probes)]
+    samples = []
+    level = 1500
+    for i in range(count):
+        level = max(0, min(4095, level + rng.randint(-20, 20)))
+        temps = {rom: round(21.5 + rng.gauss(0, 0.3), 4) for rom in roms}
+        samples.append({
+            "water_level": level,
+            "level_quality": rng.randint(80, 100),
+            "laser_beam_broken": rng.random() < 0.1,
+            "temperature": temps,
+        })
+    return samples
+
+
+def json_messages(sample):
+    # What the firmware sent before: one message per sensor, the temperature
+    # dict keyed by str() of the ROM bytearray
+    return [
+        (JSON_TOPICS["water_level"], json.dumps(sample["water_level"]).encode()),
+        (JSON_TOPICS["temperature"],
+         json.dumps({str(bytearray(rom)): t for rom, t in sample["temperature"].items()}).encode()),
+        (JSON_TOPICS["laser_beam_broken"], json.dumps(sample["laser_beam_broken"]).encode()),
+    ]
+
+
+def frame_values(sample):
+    values = dict(sample)
+    values["temperature"] = {rom.hex(): t for rom, t in sample["temperature"].items()}
+    return values
+
+
+def sizes(messages):
+    payload = sum(len(m) for _, m in messages)
+    mqtt = sum(mqtt_size(t, m) for t, m in messages)
+    air = sum(ESPNOW_OVERHEAD + len(m) for _, m in messages)
+    return payload, mqtt, air
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=20000)
+    parser.add_argument("--probes", type=int, default=2, help="DS18X20 sensors on the bus")
+    args = parser.parse_args()
+
+    telemetry = load_module("telemetry", os.path.join(ROOT, "esp32-1", "telemetry.py"))
+    app = load_module("flask_app", os.path.join(ROOT, "Flask"))
+    samples = make_samples(args.samples, args.probes)
+
+    # JSON
+    start = time.perf_counter()
+    json_out = [json_messages(s) for s in samples]
+    json_encode = time.perf_counter() - start
+    start = time.perf_counter()
+    for messages in json_out:
+        [json.loads(m) for _, m in messages]
+    json_decode = time.perf_counter() - start
+
+    # Frames, with the index table resent once a minute at one sample per second
+    encoder = telemetry.FrameEncoder(index_every_ms=60000)
+    start = time.perf_counter()
+    frame_out = [encoder.encode(frame_values(s), i * 1000) for i, s in enumerate(samples)]
+    frame_encode = time.perf_counter() - start
+    tables = {}
+    start = time.perf_counter()
+    for frames in frame_out:
+        for kind, table_id, _, body in app.iter_frames(b"".join(frames)):
+            if kind == app.FRAME_INDEX:
+                tables[table_id] = app.parse_index(body)
+            else:
+                app.decode_data(body, tables[table_id])
+    frame_decode = time.perf_counter() - start
+
+    decoded = app.decode_data(bytes(frame_out[-1][-1][app.FRAME_HEADER.size:]), tables[encoder.table_id])
+    assert decoded["water_level"] == samples[-1]["water_level"], decoded
+
+    json_sizes = sizes([m for messages in json_out for m in messages])
+    frame_sizes = sizes([(FRAME_TOPIC, f) for frames in frame_out for f in frames])
+    n = len(samples)
+
+    print(f"{n} samples, {args.probes} temperature probes")
+    print(f"{'':10} {'payload B':>10} {'MQTT B':>10} {'ESP-NOW B':>10} {'msgs':>7} {'enc/s':>10} {'dec/s':>10}")
+    for name, (payload, mqtt, air), msgs, enc, dec in [
+        ("json", json_sizes, sum(len(m) for m in json_out), json_encode, json_decode),
+        ("frames", frame_sizes, sum(len(f) for f in frame_out), frame_encode, frame_decode),
+    ]:
+        print(f"{name:10} {payload / n:10.1f} {mqtt / n:10.1f} {air / n:10.1f} {msgs / n:7.2f} "
+              f"{n / enc:10.0f} {n / dec:10.0f}")
+    print(f"reduction  {json_sizes[0] / frame_sizes[0]:10.1f}x {json_sizes[1] / frame_sizes[1]:9.1f}x "
+          f"{json_sizes[2] / frame_sizes[2]:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# Concurrent-connection scaling of the Flask dev server vs the ASGI app.
+# Starts each server, opens N connections that POST /api/telemetry as fast as
+# they can for a fixed time, and prints req/s and p99 latency per level.
+#
+#   python bench/bench_serving.py --levels 1 10 50 100 --duration 5
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, os.pardir)
+
+BODY = json.dumps({"source": "bench", "water_level": 1234, "laser_beam_broken": False}).encode()
+REQUEST = (
+    b"POST /api/telemetry HTTP/1.1\r\n"
+    b"Host: localhost\r\n"
+    b"Content-Type: application/json\r\n"
+    b"Content-Length: " + str(len(BODY)).encode() + b"\r\n"
+    b"\r\n" + BODY
+)
+
+
+async def read_response(reader):
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    await reader.readexactly(int(headers.get("content-length", 0)))
+    keep_alive = lines[0].startswith("HTTP/1.1") and headers.get("connection", "").lower() != "close"
+    return status, keep_alive
+
+
+async def client(port, deadline, latencies, errors):
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        if writer is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        start = time.perf_counter()
+        writer.write(REQUEST)
+        try:
+            status, keep_alive = await read_response(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            writer = None
+            errors.append("connection")
+            continue
+        latencies.append(time.perf_counter() - start)
+        if status not in (200, 202):
+            errors.append(status)
+        if not keep_alive:
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+async def level(port, connections, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(client(port, deadline, latencies, errors) for _ in range(connections)))
+    latencies.sort()
+    p99 = latencies[max(int(len(latencies) * 0.99) - 1, 0)] if latencies else float("nan")
+    return len(latencies) / duration, p99, len(errors)
+
+
+def wait_until_up(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/series", timeout=1)
+            return
+        except urllib.error.HTTPError:
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 10, 50, 100])
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    servers = (
+        ("flask dev server", [sys.executable, os.path.join(ROOT, "Flask")], 5000),
+        ("asgi", [sys.executable, os.path.join(ROOT, "asgi.py"), "--port", "5001",
+                  "--workers", str(args.workers)], 5001),
+    )
+
+    for name, cmd, port in servers:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(port)
+            for connections in args.levels:
+                rps, p99, errors = asyncio.run(level(port, connections, args.duration))
+                print(f"{name:18s} {connections:4d} conns {rps:8.0f} req/s   p99 {p99 * 1000:8.2f} ms   errors {errors}")
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# Load benchmark for the /api/telemetry route against a local Postgres.
+# Compares a fresh psycopg2.connect() per request (the old db_conn), pooled
+# connections with one INSERT per request, and the buffered batch writer.
+#
+#   python bench/bench_telemetry.py --requests 2000 --threads 8
+
+import argparse
+import importlib.machinery
+import importlib.util
+import os
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_app():
+    path = os.path.join(HERE, os.pardir, "Flask")
+    loader = importlib.machinery.SourceFileLoader("flask_app", path)
+    spec = importlib.util.spec_from_loader("flask_app", loader)
+    module = importlib.util.module_from_spec(spec)
+    loader.exec_module(module)
+    return module
+
+
+def run(app, requests, threads):
+    latencies = []
+    lock = threading.Lock()
+    per_thread = requests // threads
+
+    def worker():
+        client = app.test_client()
+        local = []
+        for i in range(per_thread):
+            start = time.perf_counter()
+            resp = client.post("/api/telemetry", json={"source": "bench", "water_level": i})
+            local.append(time.perf_counter() - start)
+            assert resp.status_code in (200, 202), resp.status_code
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    return len(latencies) / elapsed, statistics.median(latencies), p99
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--host", default=None, help="override DB_CONFIG['host']")
+    args = parser.parse_args()
+
+    module = load_app()
+    if args.host:
+        module.DB_CONFIG["host"] = args.host
+    module.POOL_CONFIG["max_size"] = max(module.POOL_CONFIG["max_size"], args.threads)
+
+    pooled = module.db_conn
+
+    @contextmanager
+    def unpooled():
+        conn = psycopg2.connect(**module.DB_CONFIG)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    # The first mode never goes through get_pool(), so migrate the database
+    # here, then close the pool again so that mode still connects per request
+    module.get_pool()
+    module.close_pool()
+
+    modes = (
+        ("connect per request", unpooled, False),
+        ("pooled", pooled, False),
+        ("pooled + buffered", pooled, True),
+    )
+    for name, factory, buffered in modes:
+        module.db_conn = factory
+        module.INGEST_CONFIG["buffered"] = buffered
+        rps, median, p99 = run(module.app, args.requests, args.threads)
+        print(f"{name:20s} {rps:8.0f} req/s   median {median * 1000:6.2f} ms   p99 {p99 * 1000:6.2f} ms")
+
+    # Includes the time to flush whatever the buffered run left in the queue
+    start = time.perf_counter()
+    module.stop_writer()
+    print(f"final flush          {(time.perf_counter() - start) * 1000:8.1f} ms")
+    module.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import json
+import os
+import queue
+import select
+import time
+import psycopg2
+import paho.mqtt.client as mqtt
+
+
+DB_CONFIG = {
+    "dbname": "liquid_system",
+    "user": "liquid_user",
+    "password": "liquid_pass",
+    "host": "127.0.0.1"
+}
+
+MQTT_BROKER = "localhost"
+MQTT_CLIENT_ID = "command_dispatcher"
+# The liquid system reports each finished or refused dispense here, with
+# the id of the command it ran
+STATUS_TOPIC = "liquid_system/status"
+
+# commands.target -> MQTT topic the device listens on
+TARGET_TOPICS = {
+    "liquid_system": "liquid_system/command",
+    "esp32-1": "esp32/command",
+    "gateway": "esp32/command",
+}
+# Any other dispenser behind the ESP32-2 gateway is addressed as
+# "esp32/<name>", with the name it announced on esp32/gateway/peers
+GATEWAY_TARGET_PREFIX = "esp32/"
+
+NOTIFY_CHANNEL = "commands"
+DISPATCHER_LOCK = 0x6c697164 + 2    # only one dispatcher may run at a time
+DB_RETRY_MIN = 1                    # s before the first reconnect, doubling ...
+DB_RETRY_MAX = 30                   # ... up to this
+
+
+def target_topic(target):
+    if target in TARGET_TOPICS:
+        return TARGET_TOPICS[target]
+    if target.startswith(GATEWAY_TARGET_PREFIX) and len(target) > len(GATEWAY_TARGET_PREFIX):
+        return "esp32/command/" + target[len(GATEWAY_TARGET_PREFIX):]
+    return None
+
+
+def format_command(target, command, payload, command_id):
+    # The gateway only forwards "DISPENSE:<ml>" or a bare number; the liquid
+    # system itself takes the JSON payload ({"ml": ..., "direction": ...})
+    # plus the command id, which it sends back once the dispense is done.
+    # Raises ValueError for a command the target cannot be sent as it is.
+    if target_topic(target).startswith("esp32/command"):
+        if not isinstance(payload, dict) or "ml" not in payload:
+            raise ValueError("the gateway needs a payload like {\"ml\": 5}")
+        if payload.get("direction", 1) != 1:
+            raise ValueError("the gateway can only push (direction 1)")
+        ml = float(payload["ml"])
+        # Never rounded: DISPENSE takes whole ml only
+        if not ml.is_integer() or ml < 0:
+            raise ValueError(f"the gateway takes whole ml, not {payload['ml']!r}")
+        return f"DISPENSE:{int(ml)}"
+    if not isinstance(payload, dict):
+        raise ValueError("payload must be a JSON object")
+    return json.dumps(dict(payload, command=command, id=command_id))
+
+
+class CommandDispatcher:
+
+    def __init__(self, db_config, broker, client_id):
+        self.db_config = db_config
+        self.conn = None
+        self.in_flight = {}         # MQTT message id -> command id
+        self.sent = set()           # command ids published but not yet recorded as delivered
+        self.acked = set()          # command ids with a PUBACK still to be written
+        self.results = queue.Queue()
+        self.reported = []          # (command id, error or None) still to be written
+        self.acks = queue.Queue()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, clean_session=False)
+        self.client.on_connect = self.on_connect
+        self.client.on_publish = self.on_publish
+        self.client.on_message = self.on_message
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self.broker = broker
+
+    def connect_db(self):
+        self.conn = psycopg2.connect(**self.db_config)
+        self.conn.autocommit = True
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (DISPATCHER_LOCK,))
+            if not cur.fetchone()[0]:
+                raise RuntimeError("another dispatcher is already running")
+            cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+        print("✓ Listening for new commands")
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            print(f"ERROR: MQTT connect refused: {reason_code}")
+            return
+        print("✓ Connected to MQTT broker")
+        client.subscribe(STATUS_TOPIC, qos=1)
+        # Catch up on anything inserted while the broker was unreachable
+        os.write(self.wake_w, b"c")
+
+    def on_publish(self, client, userdata, mid, reason_code, properties):
+        # Runs on the paho network thread; the DB update happens in run()
+        self.acks.put(mid)
+        os.write(self.wake_w, b"a")
+
+    def on_message(self, client, userdata, message):
+        # Also on the paho thread. Only the final status of a dispense that
+        # came from a command counts; progress reports carry no id
+        try:
+            status = json.loads(message.payload)
+        except ValueError:
+            return
+        if not isinstance(status, dict) or not isinstance(status.get("id"), int):
+            return
+        if status.get("state") == "rejected":
+            error = f"rejected by the device: {status.get('error')}"
+        elif status.get("state") == "done":
+            error = "aborted" if status.get("aborted") else None
+        else:
+            return
+        self.results.put((status["id"], error))
+        os.write(self.wake_w, b"s")
+
+    def dispatch(self, rows):
+        failed = []
+        for command_id, target, command, payload in rows:
+            if command_id in self.sent:
+                continue
+            topic = target_topic(target)
+            if topic is None:
+                failed.append((f"unknown target {target!r}", command_id))
+                continue
+            try:
+                message = format_command(target, command, json.loads(payload), command_id)
+            except (ValueError, TypeError) as e:
+                failed.append((f"bad payload: {e}", command_id))
+                continue
+
+            info = self.client.publish(topic, message, qos=1)
+            self.in_flight[info.mid] = command_id
+            self.sent.add(command_id)
+            print(f"Command {command_id} -> {topic}: {message}")
+
+        # Recorded once, so they leave the pending set instead of being
+        # rejected again on every catch-up
+        if failed:
+            with self.conn.cursor() as cur:
+                cur.executemany(
+                    "UPDATE commands SET failed_at = now(), error = %s WHERE id = %s",
+                    failed
+                )
+            for error, command_id in failed:
+                print(f"Command {command_id}: {error}, failed")
+
+    def dispatch_ids(self, ids):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, target, command, payload
+                FROM commands
+                WHERE id = ANY(%s) AND delivered_at IS NULL AND failed_at IS NULL
+                ORDER BY id
+            """, (ids,))
+            self.dispatch(cur.fetchall())
+
+    def dispatch_pending(self):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, target, command, payload
+                FROM commands
+                WHERE delivered_at IS NULL AND failed_at IS NULL
+                ORDER BY id
+            """)
+            self.dispatch(cur.fetchall())
+
+    def mark_delivered(self):
+        # PUBACK means the broker has the command, not that a device ran it:
+        # the broker acknowledges QoS 1 even with no subscriber
+        while True:
+            try:
+                mid = self.acks.get_nowait()
+            except queue.Empty:
+                break
+            command_id = self.in_flight.pop(mid, None)
+            if command_id is not None:
+                self.acked.add(command_id)
+
+        # Until the UPDATE went through the ids stay in sent, so a catch-up
+        # after a lost database connection does not publish them again
+        if self.acked:
+            with self.conn.cursor() as cur:
+                cur.execute(
+                    "UPDATE commands SET delivered_at = now() WHERE id = ANY(%s)",
+                    (list(self.acked),)
+                )
+            self.sent -= self.acked
+            self.acked.clear()
+
+    def mark_executed(self):
+        # Kept until written, like the PUBACKs, so a lost database
+        # connection does not lose a result
+        while True:
+            try:
+                self.reported.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        if not self.reported:
+            return
+
+        done = [command_id for command_id, error in self.reported if error is None]
+        failed = [(error, command_id) for command_id, error in self.reported if error is not None]
+        with self.conn.cursor() as cur:
+            if done:
+                cur.execute("UPDATE commands SET executed = TRUE WHERE id = ANY(%s)", (done,))
+            if failed:
+                cur.executemany(
+                    "UPDATE commands SET failed_at = now(), error = %s WHERE id = %s",
+                    failed
+                )
+        for command_id, error in self.reported:
+            print(f"Command {command_id}: {error or 'executed'}")
+        self.reported = []
+
+    def reconnect_db(self):
+        # Postgres restarted or the connection dropped. The advisory lock and
+        # the LISTEN went with the old session, so connect_db() takes both
+        # again; anything inserted meanwhile raised no notification we saw.
+        try:
+            self.conn.close()
+        except psycopg2.Error:
+            pass
+        delay = DB_RETRY_MIN
+        while True:
+            time.sleep(delay)
+            try:
+                self.connect_db()
+                self.mark_delivered()
+                self.mark_executed()
+                self.dispatch_pending()
+                return
+            except (psycopg2.OperationalError, psycopg2.InterfaceError, RuntimeError) as e:
+                # RuntimeError: the server has not noticed the old session
+                # is gone yet and still holds its lock
+                print(f"ERROR: database reconnect failed: {e}")
+                delay = min(delay * 2, DB_RETRY_MAX)
+
+    def serve(self):
+        while True:
+            # Sleeps until Postgres has a notification or paho wakes us
+            readable, _, _ = select.select([self.conn, self.wake_r], [], [])
+
+            catch_up = False
+            if self.wake_r in readable:
+                catch_up = b"c" in os.read(self.wake_r, 4096)
+                self.mark_delivered()
+                self.mark_executed()
+
+            if self.conn in readable:
+                self.conn.poll()
+                ids = []
+                while self.conn.notifies:
+                    ids.append(int(self.conn.notifies.pop(0).payload))
+                if ids:
+                    self.dispatch_ids(ids)
+
+            if catch_up:
+                self.dispatch_pending()
+
+    def run(self):
+        self.connect_db()
+        self.client.connect_async(self.broker)
+        self.client.loop_start()
+
+        try:
+            while True:
+                try:
+                    self.serve()
+                except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                    print(f"ERROR: lost the database connection: {e}")
+                    self.reconnect_db()
+                    print("✓ Database connection restored")
+
+        except KeyboardInterrupt:
+            print("\n\nDispatcher interrupted by user")
+        finally:
+            self.client.loop_stop()
+            self.client.disconnect()
+            self.conn.close()
+
+
+def main():
+    dispatcher = CommandDispatcher(DB_CONFIG, MQTT_BROKER, MQTT_CLIENT_ID)
+    dispatcher.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,53 @@ MQTT_BROKER = "localhost"
 MQTT_CLIENT_ID = "rasp_liquid_system"
 MQTT_TOPIC_COMMAND = "liquid_system/command"
 MQTT_TOPIC_STATUS = "liquid_system/status"
-MQTT_TOPIC_LEVEL = "liquid_system/level"
-MQTT_TOPIC_TEMP = "liquid_system/temperature"
+MQTT_TOPIC_TELEMETRY = "liquid_system/telemetry"
 
-STEPS_PER_ML = 170
\ No newline at end of file
+STEPS_PER_ML = 170
+
+
+CLOSED_LOOP = False
+LEVEL_COUNTS_PER_ML = 50
+LEVEL_LAG_MS = 300
+LEVEL_SAMPLE_MS = 20
+CLOSED_LOOP_SLOW_AT = 0.85
+CLOSED_LOOP_MAX_STEPS = 1.3
+
+
+SYRINGE_CAPACITY_ML = 20
+POSITION_FILE = "position.json"
+
+
+
+STEPPER_MAX_HZ = 1700
+STEPPER_ACCEL = 3000
+STEPPER_PROFILE = "trapezoid"
+
+
+COMMAND_POLL_MS = 20
+LINK_POLL_MS = 50
+PROGRESS_INTERVAL_MS = 1000
+
+
+
+
+SENSOR_SCHEDULES = {
+    "water_level": {"rate_ms": 50, "deadband": 10, "heartbeat_ms": 30000},
+    "temperature": {"rate_ms": 1000, "deadband": 0.2, "heartbeat_ms": 60000},
+    "laser_beam_broken": {"rate_ms": 50, "deadband": 0, "heartbeat_ms": 60000},
+}
+TELEMETRY_INDEX_MS = 600000
+
+
+
+
+SPOOL_FILE = "spool.bin"
+SPOOL_RAM_ITEMS = 32
+SPOOL_SLOTS = 128
+SPOOL_SLOT_SIZE = 512
+SPOOL_DRAIN_BYTES = 1024
+RECONNECT_MIN_MS = 1000
+RECONNECT_MAX_MS = 60000
+MQTT_CONNECT_TIMEOUT = 1
+
+MAX_QUEUED_DISPENSES = 5
@@ -1,11 +1,24 @@
 import json
 import time
-from machine import Pin, ADC
 from umqtt.simple import MQTTClient
-from config import MQTT_BROKER, MQTT_CLIENT_ID, MQTT_TOPIC_COMMAND, MQTT_TOPIC_LEVEL, MQTT_TOPIC_TEMP, STEPS_PER_ML
+from config import MQTT_BROKER, MQTT_CLIENT_ID, MQTT_TOPIC_COMMAND, MQTT_TOPIC_TELEMETRY, STEPS_PER_ML
+from config import SENSOR_SCHEDULES, TELEMETRY_INDEX_MS
+from config import MQTT_TOPIC_STATUS, MAX_QUEUED_DISPENSES, PROGRESS_INTERVAL_MS
+from config import STEPPER_MAX_HZ, STEPPER_ACCEL, STEPPER_PROFILE, SYRINGE_CAPACITY_ML, POSITION_FILE
+from config import CLOSED_LOOP, LEVEL_COUNTS_PER_ML, LEVEL_LAG_MS, LEVEL_SAMPLE_MS
+from config import CLOSED_LOOP_SLOW_AT, CLOSED_LOOP_MAX_STEPS
+from config import COMMAND_POLL_MS, LINK_POLL_MS, RECONNECT_MIN_MS, RECONNECT_MAX_MS, MQTT_CONNECT_TIMEOUT
+from config import SPOOL_FILE, SPOOL_RAM_ITEMS, SPOOL_SLOTS, SPOOL_SLOT_SIZE, SPOOL_DRAIN_BYTES
 from stepper import Stepper
-from sensors import TemperatureSensor, PhotoResistor, LaserModule
+from syringe import Syringe
+from sensors import TemperatureSensor, PhotoResistor, LaserModule, SensorSchedule
+from telemetry import FrameEncoder
+from spool import Spool, Backoff
 
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 
 
@@ -17,12 +30,21 @@ class LiquidDispensationSystem:
         self.mqtt_broker = mqtt_broker
         self.client_id = client_id
         self.client = None
+        self.link_up = False
+        self.backoff = Backoff(RECONNECT_MIN_MS, RECONNECT_MAX_MS)
+        self.spool = None
+        self.index_pending = False
         self.stepper = None
+        self.syringe = None
         self.temp_sensor = None
         self.photo_resistor = None
         self.laser = None
         self.current_level = 0
         self.is_running = False
+        self.schedules = []
+        self.encoder = FrameEncoder(TELEMETRY_INDEX_MS)
+        self.pending = []
+        self.motor_wakeup = asyncio.Event()
         
     def init_components(self):
         
@@ -33,11 +55,12 @@ class LiquidDispensationSystem:
             
             
             print("Initializing Stepper Motor...")
-            in1 = Pin(16, Pin.OUT)
-            in2 = Pin(17, Pin.OUT)
-            in3 = Pin(5, Pin.OUT)
-            in4 = Pin(18, Pin.OUT)
-            self.stepper = Stepper(in1, in2, in3, in4, delay=1, mode=0)
+            
+            
+            in1, in2, in3, in4 = 16, 17, 5, 18
+            self.stepper = Stepper(in1, in2, in3, in4, delay=1, mode=0, max_hz=STEPPER_MAX_HZ,
+                                   accel=STEPPER_ACCEL, profile=STEPPER_PROFILE)
+            self.syringe = Syringe(self.stepper, STEPS_PER_ML, SYRINGE_CAPACITY_ML, POSITION_FILE)
             print("✓ Stepper Motor initialized")
             
             
@@ -56,6 +79,21 @@ class LiquidDispensationSystem:
             self.laser.laser_on()
             print("✓ Laser Module initialized")
             
+            
+            print("Initializing telemetry spool...")
+            self.spool = Spool(SPOOL_FILE, SPOOL_RAM_ITEMS, SPOOL_SLOTS, SPOOL_SLOT_SIZE)
+            print("✓ Telemetry spool initialized")
+            
+            
+            
+            reads = {
+                "temperature": self.temp_sensor.update,
+                "water_level": self.photo_resistor.read,
+                "laser_beam_broken": self.laser.is_beam_broken,
+            }
+            self.schedules = [SensorSchedule(name, reads[name], **SENSOR_SCHEDULES[name])
+                              for name in reads]
+            
             print("\nAll components initialized successfully!\n")
             return True
             
@@ -67,15 +105,33 @@ class LiquidDispensationSystem:
         
         try:
             print(f"Connecting to MQTT broker at {self.mqtt_broker}...")
-            self.client = MQTTClient(self.client_id, self.mqtt_broker)
-            self.client.set_callback(self.mqtt_callback)
-            self.client.connect()
+            if self.client is None:
+                self.client = MQTTClient(self.client_id, self.mqtt_broker)
+                self.client.set_callback(self.mqtt_callback)
+            
+            
+            self.client.connect(timeout=MQTT_CONNECT_TIMEOUT)
             self.client.subscribe(MQTT_TOPIC_COMMAND)
-            print("✓ Connected to MQTT broker")
+            self.link_up = True
+            self.backoff.reset()
+            print(f"✓ Connected to MQTT broker, {len(self.spool)} telemetry messages waiting")
             return True
         except Exception as e:
             print(f"ERROR: Failed to connect to MQTT: {e}")
+            self.backoff.failed()
             return False
+
+    def link_lost(self):
+        
+        if self.link_up:
+            print("MQTT link lost, keeping telemetry until it is back")
+        self.link_up = False
+        self.index_pending = True
+        self.backoff.failed()
+        try:
+            self.client.sock.close()
+        except Exception:
+            pass
     
     def mqtt_callback(self, topic, msg):
         
@@ -86,60 +142,123 @@ class LiquidDispensationSystem:
             
             try:
                 cmd = json.loads(message)
+                if not isinstance(cmd, dict):
+                    cmd = {'ml': cmd}
+                command = cmd.get('command')
+                
+                command_id = cmd.get('id')
+                if command in ('stop', 'abort'):
+                    self.abort()
+                    return
+                if command == 'set_volume':
+                    
+                    if self.stepper.busy or self.pending:
+                        print("Can't set the syringe volume while dispensing")
+                        return
+                    ml = float(cmd['ml'])
+                    if not 0 <= ml <= SYRINGE_CAPACITY_ML:
+                        print(f"Syringe volume {ml} ml is out of range")
+                        return
+                    self.syringe.set_volume(ml)
+                    print(f"Syringe volume set to {self.syringe.volume_ml():.2f} ml")
+                    return
+                if command == 'goto':
+                    
+                    self.request_dispense(0, target=float(cmd['ml']), command_id=command_id)
+                    return
                 ml_amount = float(cmd.get('ml', 0))
                 direction = int(cmd.get('direction', 1)) 
+                closed_loop = bool(cmd.get('closed_loop', CLOSED_LOOP))
                 
                 if ml_amount > 0:
-                    self.dispense_liquid(ml_amount, direction)
+                    self.request_dispense(ml_amount, direction, closed_loop=closed_loop, command_id=command_id)
                 else:
                     print("Invalid ml amount")
                     
-            except json.JSONDecodeError:
+            except ValueError:
+                
+                if message.strip().lower() in ('stop', 'abort'):
+                    self.abort()
+                    return
                 
                 try:
                     ml_amount = float(message)
-                    self.dispense_liquid(ml_amount, direction=1)
+                    self.request_dispense(ml_amount, direction=1)
                 except ValueError:
                     print(f"Could not parse command: {message}")
                     
         except Exception as e:
             print(f"ERROR in callback: {e}")
     
-    def dispense_liquid(self, ml_amount, direction=1):
+    def request_dispense(self, ml_amount, direction=1, target=None, closed_loop=CLOSED_LOOP, command_id=None):
+        
+        if len(self.pending) >= MAX_QUEUED_DISPENSES:
+            print("⚠️  Too many dispenses queued, command dropped")
+            self.publish_rejected(ml_amount, direction, "too many dispenses queued", command_id)
+            return
+        self.pending.append((ml_amount, direction, target, closed_loop, command_id))
+        self.motor_wakeup.set()
+
+    def abort(self):
+        
+        print("⚠️  Abort: stopping motor")
+        self.pending = []
+        self.stepper.stop()
+
+    async def dispense_liquid(self, ml_amount, direction=1, closed_loop=False, command_id=None):
         
         if self.is_running:
             print(" System already running, please wait")
             return
         
+        try:
+            
+            
+            self.syringe.check(ml_amount * direction)
+        except ValueError as e:
+            print(f"Rejected {ml_amount} ml: {e}")
+            self.publish_rejected(ml_amount, direction, str(e), command_id)
+            return
+        
         self.is_running = True
-        steps = int(ml_amount * STEPS_PER_ML)
+        steps = round(ml_amount * STEPS_PER_ML)
         
         print(f"\n{'='*60}")
         print(f"Dispensing {ml_amount} ml ({steps} steps)...")
         print(f"Direction: {'PUSH (dispense)' if direction > 0 else 'PULL (draw)'}")
+        closed_loop = closed_loop and direction > 0
+        if closed_loop:
+            print("Mode: closed loop (level sensor feedback)")
         print(f"{'='*60}\n")
         
         try:
             
-            initial_level = self.photo_resistor.read()
+            initial_level = self.photo_resistor.read_median()
             print(f"Initial water level: {initial_level}")
             
             
-            if direction > 0:
-                self.stepper.step(steps, direction=1)
+            start = self.stepper.position
+            self.syringe.save(moving=True)
+            if closed_loop:
+                result = await self.closed_loop_move(ml_amount, steps, initial_level)
             else:
-                self.stepper.step(steps, direction=-1)
+                result = await self.open_loop_move(ml_amount, steps, direction)
+            moved = abs(self.stepper.position - start) // self.stepper.phases
+            self.syringe.save()
+            print(f"Moved {moved} of {steps} steps: {result}")
             
-            time.sleep(1)
+            await asyncio.sleep(1)
             
             
-            final_level = self.photo_resistor.read()
+            final_level = self.photo_resistor.read_median()
             displacement = final_level - initial_level
             print(f"Final water level: {final_level}")
             print(f"Water level change: {displacement}")
             
             
-            self.publish_status(ml_amount, initial_level, final_level, displacement)
+            self.publish_status(ml_amount, initial_level, final_level, displacement,
+                                dispensed=round(direction * moved / STEPS_PER_ML, 3), aborted=result == 'aborted',
+                                result=result, closed_loop=closed_loop, id=command_id)
             
         except Exception as e:
             print(f"ERROR during dispensing: {e}")
@@ -147,79 +266,225 @@ class LiquidDispensationSystem:
             self.is_running = False
             print("✓ Dispensing complete\n")
     
-    def sensor_reader_loop(self):
-    
-        data = {}
+    async def open_loop_move(self, ml_amount, steps, direction):
+        
+        start = self.stepper.position
+        self.stepper.move(steps, direction=1 if direction > 0 else -1)
+        last_report = time.ticks_ms()
+        while self.stepper.busy:
+            await asyncio.sleep_ms(COMMAND_POLL_MS)
+            if time.ticks_diff(time.ticks_ms(), last_report) >= PROGRESS_INTERVAL_MS:
+                last_report = time.ticks_ms()
+                self.publish_progress(ml_amount)
+        moved = abs(self.stepper.position - start) // self.stepper.phases
+        return 'done' if moved >= steps else 'aborted'
+
+    async def closed_loop_move(self, ml_amount, steps, initial_level):
+        
+        stepper = self.stepper
+        start = stepper.position
+        limit = round(steps * CLOSED_LOOP_MAX_STEPS)
+        
+        volume = self.syringe.volume_ml()
+        if volume is not None:
+            limit = min(limit, int(volume * STEPS_PER_ML))
+        creep_hz = stepper.ramp[0]
+        
+        
+        smoothing = 0.3
+        lag_ms = LEVEL_LAG_MS + LEVEL_SAMPLE_MS * (1 / smoothing - 1)
+        lag_ml = creep_hz / self.syringe.phases_per_ml * lag_ms / 1000
+        level = initial_level
+
+        stepper.move(limit)
+        result = None
+        last_report = time.ticks_ms()
+        while stepper.busy:
+            await asyncio.sleep_ms(LEVEL_SAMPLE_MS)
+            level += (self.photo_resistor.read_median() - level) * smoothing
+            arrived = (level - initial_level) / LEVEL_COUNTS_PER_ML
+            if self.laser.is_beam_broken():
+                result = 'overflow'
+            elif arrived >= ml_amount - (lag_ml if stepper.speed_limit else 0):
+                result = 'arrived'
+            if result:
+                stepper.stop()
+                break
+
+            pushed = (stepper.position - start) / self.syringe.phases_per_ml
+            if not stepper.speed_limit and max(arrived, pushed) >= ml_amount * CLOSED_LOOP_SLOW_AT:
+                stepper.speed_limit = creep_hz
+            if time.ticks_diff(time.ticks_ms(), last_report) >= PROGRESS_INTERVAL_MS:
+                last_report = time.ticks_ms()
+                self.publish_progress(ml_amount)
+        stepper.speed_limit = 0
+
+        if result is None:
+            moved = (stepper.position - start) // stepper.phases
+            result = 'limit' if moved >= limit else 'aborted'
+        if result != 'arrived':
+            print(f"⚠️  Closed-loop dispense ended: {result}")
+        return result
+
+    def publish_status(self, ml_amount, initial_level, final_level, displacement, **extra):
+        
+        if not self.link_up:
+            return
+        status = {
+            'state': 'done',
+            'ml': ml_amount,
+            'initial_level': initial_level,
+            'final_level': final_level,
+            'displacement': displacement,
+            'position': self.stepper.position,
+            'volume': self.syringe.volume_ml()
+        }
+        status.update(extra)
+        self.client.publish(MQTT_TOPIC_STATUS, json.dumps(status))
+
+    def publish_progress(self, ml_amount):
         
+        if not self.link_up:
+            return
         try:
-           
-            temps = self.temp_sensor.read_all()
-            data['temperature'] = temps
-            
-            
-            data['water_level'] = self.photo_resistor.read()
-            
-            
-            data['laser_beam_broken'] = self.laser.is_beam_broken()
-            
-            return data
+            self.client.publish(MQTT_TOPIC_STATUS, json.dumps({
+                'state': 'dispensing',
+                'ml': ml_amount,
+                'progress': round(self.stepper.progress(), 3),
+                'position': self.stepper.position,
+                'volume': self.syringe.volume_ml(),
+                'queued': len(self.pending)
+            }))
         except Exception as e:
-            print(f"ERROR reading sensors: {e}")
-            return None
-    
-    def network_sender_loop(self):
+            print(f"ERROR publishing progress: {e}")
+            self.link_lost()
+
+    def publish_rejected(self, ml_amount, direction, reason, command_id=None):
         
+        if not self.link_up:
+            return
         try:
-            data = self.sensor_reader_loop()
-            if data and self.client:
-                water_level = data["water_level"]
-                temperature = data["temperature"]
-                
-                
-                if water_level is not None:
-                    self.client.publish(MQTT_TOPIC_LEVEL, str(water_level))
-                
-                
-                if temperature:
-                    temp_str = json.dumps(temperature)
-                    self.client.publish(MQTT_TOPIC_TEMP, temp_str)
+            self.client.publish(MQTT_TOPIC_STATUS, json.dumps({
+                'state': 'rejected',
+                'id': command_id,
+                'ml': ml_amount * direction,
+                'volume': self.syringe.volume_ml(),
+                'error': reason
+            }))
+        except Exception as e:
+            print(f"ERROR publishing status: {e}")
+            self.link_lost()
+
+    def publish_telemetry(self, values):
+        
+        frames = b''.join(self.encoder.encode(values, time.ticks_ms()))
+        
+        if self.link_up and not len(self.spool):
+            try:
+                self.client.publish(MQTT_TOPIC_TELEMETRY, frames)
+                return
+            except Exception as e:
+                print(f"ERROR publishing telemetry: {e}")
+                self.link_lost()
+        self.spool.push(frames)
+
+    def drain_spool(self):
+        
+        chunks = self.spool.peek(SPOOL_DRAIN_BYTES)
+        now = time.ticks_ms()
+        
+        
+        head = self.encoder.index(now) if self.index_pending and self.encoder.table else b''
+        try:
+            self.client.publish(MQTT_TOPIC_TELEMETRY, head + b''.join(chunks) + self.encoder.clock(now))
         except Exception as e:
-            print(f"ERROR in network sender: {e}")
+            print(f"ERROR publishing spooled telemetry: {e}")
+            self.link_lost()
+            return
+        self.spool.drop(len(chunks))
+        self.index_pending = False
+
+    async def sensor_task(self):
+        
+        while True:
+            report = []
+            for schedule in self.schedules:
+                if schedule.until_due():
+                    continue
+                try:
+                    schedule.sample()
+                except Exception as e:
+                    print(f"ERROR reading {schedule.name}: {e}")
+                    continue
+                if schedule.should_report():
+                    report.append(schedule)
+            
+            
+            if report:
+                self.publish_telemetry({schedule.name: schedule.value for schedule in report})
+                for schedule in report:
+                    schedule.mark_reported()
+            await asyncio.sleep_ms(min(schedule.until_due() for schedule in self.schedules))
     
-    def run(self):
+    async def command_task(self):
        
-        print("\nStarting main event loop...")
+        while True:
+            if self.link_up:
+                try:
+                    self.client.check_msg()
+                except Exception as e:
+                    print(f"MQTT check error: {e}")
+                    self.link_lost()
+            await asyncio.sleep_ms(COMMAND_POLL_MS)
+
+    async def link_task(self):
         
-        mqtt_connected = self.connect_mqtt()
+        while True:
+            if not self.link_up:
+                
+                if self.backoff.due() and not self.stepper.busy:
+                    self.connect_mqtt()
+            elif len(self.spool):
+                self.drain_spool()
+            await asyncio.sleep_ms(LINK_POLL_MS)
+
+    async def motor_task(self):
         
-        sensor_timer = 0
-        network_timer = 0
+        while True:
+            await self.motor_wakeup.wait()
+            self.motor_wakeup.clear()
+            while self.pending:
+                ml_amount, direction, target, closed_loop, command_id = self.pending.pop(0)
+                if target is not None:
+                    
+                    try:
+                        change = self.syringe.change_to(target)
+                    except ValueError as e:
+                        print(f"Rejected move to {target} ml: {e}")
+                        self.publish_rejected(target, 1, str(e), command_id)
+                        continue
+                    ml_amount = abs(change)
+                    direction = 1 if change > 0 else -1
+                    if ml_amount * STEPS_PER_ML < 1:
+                        print(f"Already at {target} ml")
+                        continue
+                await self.dispense_liquid(ml_amount, direction, closed_loop, command_id)
+
+    async def main_tasks(self):
         
+        self.connect_mqtt()
+        asyncio.create_task(self.command_task())
+        asyncio.create_task(self.link_task())
+        asyncio.create_task(self.sensor_task())
         print("✓ Main loop started\n")
+        await self.motor_task()
+
+    def run(self):
+        
+        print("\nStarting main event loop...")
         
         try:
-            while True:
-                
-                if mqtt_connected:
-                    try:
-                        self.client.check_msg()
-                    except Exception as e:
-                        print(f"MQTT check error: {e}")
-                
-               
-                sensor_timer += 100
-                if sensor_timer >= 50:
-                    data = self.sensor_reader_loop()
-                    sensor_timer = 0
-                
-                
-                network_timer += 100
-                if network_timer >= 2000:
-                    self.network_sender_loop()
-                    network_timer = 0
-                
-                time.sleep_ms(100)  
-                
+            asyncio.run(self.main_tasks())
         except KeyboardInterrupt:
             print("\n\nProgram interrupted by user")
             self.shutdown()
@@ -230,7 +495,8 @@ class LiquidDispensationSystem:
         
        
         if self.stepper:
-            self.stepper.reset()
+            self.stepper.stop()
+            self.syringe.save()
         
         
         if self.laser:
@@ -1,47 +1,157 @@
 import time
 import machine
+from array import array
+from ubinascii import hexlify
 from machine import Pin, ADC
 import onewire
 import ds18x20
 
 class TemperatureSensor:
     
-    def __init__(self, pin):
+    CONVERSION_MS = 750
+
+    def __init__(self, pin, interval_ms=1000):
         ds_pin = machine.Pin(pin)
         self.ds_sensor = ds18x20.DS18X20(onewire.OneWire(ds_pin))
         self.roms = self.ds_sensor.scan()
+        self.interval_ms = interval_ms
+        self.temperatures = {}
+        self.updated = None
+        self.started = None
+        self.last_start = None
         print('Found DS devices: ', self.roms)
-    
-    def read_all(self):
+
+    def start_conversion(self):
         
         self.ds_sensor.convert_temp()
-        time.sleep_ms(750)
-        temperatures = {}
+        self.started = self.last_start = time.ticks_ms()
+
+    def conversion_ready(self):
+        
+        return (self.started is not None and
+                time.ticks_diff(time.ticks_ms(), self.started) >= self.CONVERSION_MS)
+
+    def collect(self):
+        
+        if not self.conversion_ready():
+            return False
+        self.started = None
+        good = False
         for rom in self.roms:
-            temperatures[str(rom)] = self.ds_sensor.read_temp(rom)
-        return temperatures
+            try:
+                value = self.ds_sensor.read_temp(rom)
+            except Exception as e:
+                print(f"Temperature read failed: {e}")
+                continue
+            
+            if value is None or value == 85.0:
+                continue
+            self.temperatures[hexlify(rom).decode()] = value
+            good = True
+        if good:
+            self.updated = time.ticks_ms()
+        return True
+
+    def update(self):
+        
+        self.collect()
+        if self.started is None and (self.last_start is None or
+                time.ticks_diff(time.ticks_ms(), self.last_start) >= self.interval_ms):
+            self.start_conversion()
+        return self.temperatures
+
+    def age_ms(self):
+        
+        if self.updated is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self.updated)
+
+    def read_all(self):
+        
+        self.start_conversion()
+        time.sleep_ms(self.CONVERSION_MS)
+        self.collect()
+        return self.temperatures
+
+
+class FilteredADC:
+    
+    def __init__(self, adc, burst=8, shift=2):
+        self.adc = adc
+        self.burst = burst
+        self.scratch = array('H', [0] * burst)
+        self.shift = shift
+        self.ema = -1
+        self.median = 0
+        self.spread = 0
+
+    def sample(self):
+        
+        scratch = self.scratch
+        n = self.burst
+        for i in range(n):
+            v = self.adc.read()
+            
+            j = i
+            while j > 0 and scratch[j - 1] > v:
+                scratch[j] = scratch[j - 1]
+                j -= 1
+            scratch[j] = v
+
+        self.median = scratch[n >> 1]
+        self.spread = scratch[(3 * n) >> 2] - scratch[n >> 2]
+        if self.ema < 0:
+            self.ema = self.median << 4
+        else:
+            self.ema += ((self.median << 4) - self.ema) >> self.shift
+        return (self.ema + 8) >> 4
+
+    def value(self):
+        
+        return (self.ema + 8) >> 4
+
+    def quality(self):
+        
+        return 100 * 32 // (32 + self.spread)
 
 
 class PhotoResistor:
     
-    def __init__(self, pin):
+    def __init__(self, pin, burst=8):
         self.ldr = ADC(Pin(pin))
         self.ldr.atten(ADC.ATTN_11DB)  # full range 0–3.3V
         self.ldr.width(ADC.WIDTH_12BIT)
+        self.filter = FilteredADC(self.ldr, burst)
     
     def read(self):
         
+        return self.filter.sample()
+
+    def read_raw(self):
+        
         return self.ldr.read()
 
+    def read_median(self):
+        
+        self.filter.sample()
+        return self.filter.median
+
+    def quality(self):
+        
+        return self.filter.quality()
+
 
 class LaserModule:
     
-    def __init__(self, laser_pin, ldr_pin, threshold=4000):
+    def __init__(self, laser_pin, ldr_pin, threshold=4000, hysteresis=100):
         self.laser = Pin(laser_pin, Pin.OUT)
         self.ldr = ADC(Pin(ldr_pin))
         self.ldr.atten(ADC.ATTN_11DB)
         self.ldr.width(ADC.WIDTH_12BIT)
+        self.filter = FilteredADC(self.ldr, burst=5)
         self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.broken = False
     
     def laser_on(self):
         
@@ -53,6 +163,62 @@ class LaserModule:
     
     def is_beam_broken(self):
         
-        value = self.ldr.read()
-        return value > self.threshold
+        self.filter.sample()
+        value = self.filter.median
+        if self.broken:
+            if value < self.threshold - self.hysteresis:
+                self.broken = False
+        elif value > self.threshold:
+            self.broken = True
+        return self.broken
+
 
+class SensorSchedule:
+    
+    def __init__(self, name, read, rate_ms, deadband=0, heartbeat_ms=60000):
+        self.name = name
+        self.read = read
+        self.rate_ms = rate_ms
+        self.deadband = deadband
+        self.heartbeat_ms = heartbeat_ms
+        self.deadline = time.ticks_ms()
+        self.value = None
+        self.reported = None
+        self.reported_at = None
+
+    def until_due(self):
+        
+        return max(0, time.ticks_diff(self.deadline, time.ticks_ms()))
+
+    def sample(self):
+        
+        self.value = self.read()
+        now = time.ticks_ms()
+        self.deadline = time.ticks_add(self.deadline, self.rate_ms)
+        if time.ticks_diff(self.deadline, now) < 0:
+            
+            self.deadline = time.ticks_add(now, self.rate_ms)
+        return self.value
+
+    def changed(self):
+        
+        old, new = self.reported, self.value
+        if isinstance(new, dict):
+            if not isinstance(old, dict) or len(old) != len(new):
+                return True
+            return any(k not in old or abs(new[k] - old[k]) > self.deadband for k in new)
+        if isinstance(new, bool) or old is None or new is None:
+            return new != old
+        return abs(new - old) > self.deadband
+
+    def should_report(self):
+        if self.value is None or self.value == {}:
+            return False
+        if self.reported_at is None or self.changed():
+            return True
+        return time.ticks_diff(time.ticks_ms(), self.reported_at) >= self.heartbeat_ms
+
+    def mark_reported(self):
+        
+        self.reported = dict(self.value) if isinstance(self.value, dict) else self.value
+        self.reported_at = time.ticks_ms()
@@ -1,9 +1,34 @@
+import sys
 import time
-from machine import Pin
+import machine
+import micropython
+from machine import Pin, Timer
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+_GPIO_BASE = {
+    'ESP32': 0x3FF44000,
+    'ESP32S2': 0x3F404000,
+    'ESP32S3': 0x60004000,
+    'ESP32C3': 0x60004000,
+}
+_CHIP = getattr(sys.implementation, '_machine', '').split(' with ')[-1]
+if _CHIP in _GPIO_BASE:
+    GPIO_OUT_W1TS = _GPIO_BASE[_CHIP] + 0x08
+    GPIO_OUT_W1TC = _GPIO_BASE[_CHIP] + 0x0C
+else:
+    GPIO_OUT_W1TS = GPIO_OUT_W1TC = None
 
 
 class Stepper:
     
+    TRAPEZOID = 'trapezoid'
+    SCURVE = 'scurve'
+
     FULL_ROTATION = int(4075.7728395061727 / 8)
 
     HALF_STEP = [
@@ -24,7 +49,8 @@ class Stepper:
         [1, 0, 0, 1]
     ]
     
-    def __init__(self, pin1, pin2, pin3, pin4, delay, mode=1):
+    def __init__(self, pin1, pin2, pin3, pin4, delay, mode=1, timer_id=0,
+                 max_hz=None, accel=None, profile=TRAPEZOID):
         if mode == 1:
             self.mode = self.FULL_STEP
         elif mode == 0:
@@ -37,22 +63,149 @@ class Stepper:
         self.pin3 = Pin(pin3, Pin.OUT)
         self.pin4 = Pin(pin4, Pin.OUT)
         self.delay = delay  
+
+        
+        
+        
+        self.phases = len(self.mode)
+        self.patterns = bytes(b[0] << 3 | b[1] << 2 | b[2] << 1 | b[3] for b in self.mode)
+        gpio = (pin1, pin2, pin3, pin4)
+        self.direct = GPIO_OUT_W1TS is not None and hasattr(machine, 'mem32') and all(isinstance(p, int) and p < 32 for p in gpio)
+        if self.direct:
+            self.coil_mask = (1 << pin1) | (1 << pin2) | (1 << pin3) | (1 << pin4)
+            self.set_masks = tuple(
+                sum(1 << p for p, on in zip(gpio, b) if on) for b in self.mode
+            )
+            self.clear_masks = tuple(self.coil_mask & ~m for m in self.set_masks)
+        self.coils = 0
+
+        self.timer = Timer(timer_id)
+        self.running = False
+        self.position = 0
+        self.index = 0
+        self.moves = []
+        self.direction = 1
+        self.total = 0
+        self.remaining = 0
+        self.speed_limit = 0
+        self.callback = self._tick
+        self.set_profile(max_hz, accel, profile)
         
         self.reset()
+
+    def set_profile(self, max_hz=None, accel=None, profile=TRAPEZOID):
         
-    def step(self, count, direction=1):
+        start = 1000 // self.delay
+        ramp = [start]
+        if max_hz and accel and max_hz > start:
+            if profile == self.SCURVE:
+                
+                
+                dv = max_hz - start
+                peak = 0
+                for i in range(51):
+                    x = i / 50
+                    peak = max(peak, (start + dv * x * x * (3 - 2 * x)) * dv * 6 * x * (1 - x))
+                n = int(peak / accel) + 1
+                for d in range(1, n):
+                    x = d / n
+                    ramp.append(int(start + dv * x * x * (3 - 2 * x)))
+            else:
+                
+                n = int((max_hz * max_hz - start * start) / (2 * accel)) + 1
+                for d in range(1, n):
+                    ramp.append(int(min(max_hz, (start * start + 2 * accel * d) ** 0.5)))
+            ramp.append(max_hz)
+        
+        self.ramp = ramp
+
+    @property
+    def busy(self):
+        
+        return self.remaining > 0 or len(self.moves) > 0
+
+    def move(self, count, direction=1):
         
         if count < 0:
             direction = -1
             count = -count
-        for x in range(count):
-            for bit in self.mode[::direction]:
-                self.pin1(bit[0])
-                self.pin2(bit[1])
-                self.pin3(bit[2])
-                self.pin4(bit[3])
-                time.sleep_ms(self.delay)
+        if count == 0:
+            return
+        self.moves.append(count * self.phases * direction)
+        if not self.running:
+            self.running = True
+            self.timer.init(mode=Timer.ONE_SHOT, freq=self.ramp[0], callback=self.callback)
+
+    @micropython.native
+    def _tick(self, timer):
+        
+        if self.remaining == 0:
+            if not self.moves:
+                
+                self.timer.deinit()
+                self.running = False
+                self.reset()
+                return
+            phases = self.moves.pop(0)
+            self.direction = 1 if phases > 0 else -1
+            self.total = self.remaining = abs(phases)
+
+        index = (self.index + self.direction) % self.phases
+        self.index = index
+        if self.direct:
+            machine.mem32[GPIO_OUT_W1TC] = self.clear_masks[index]
+            machine.mem32[GPIO_OUT_W1TS] = self.set_masks[index]
+        else:
+            self._write(self.patterns[index])
+        self.position += self.direction
+        self.remaining -= 1
+
+        
+        
+        d = min(self.total - self.remaining, self.remaining)
+        ramp = self.ramp
+        freq = ramp[d] if d < len(ramp) else ramp[-1]
+        if self.speed_limit and freq > self.speed_limit:
+            freq = self.speed_limit
+        self.timer.init(mode=Timer.ONE_SHOT, freq=freq, callback=self.callback)
+
+    def _write(self, pattern):
+        
+        changed = pattern ^ self.coils
+        if changed & 8:
+            self.pin1(pattern >> 3 & 1)
+        if changed & 4:
+            self.pin2(pattern >> 2 & 1)
+        if changed & 2:
+            self.pin3(pattern >> 1 & 1)
+        if changed & 1:
+            self.pin4(pattern & 1)
+        self.coils = pattern
+
+    def progress(self):
+        
+        if self.remaining == 0 or self.total == 0:
+            return 1.0
+        return 1 - self.remaining / self.total
+
+    def stop(self):
+        
+        self.timer.deinit()
+        self.running = False
+        self.moves = []
+        self.remaining = 0
         self.reset()
+
+    async def wait(self, poll_ms=20):
+        
+        while self.busy:
+            await asyncio.sleep_ms(poll_ms)
+        
+    def step(self, count, direction=1):
+        
+        self.move(count, direction)
+        while self.busy:
+            time.sleep_ms(self.delay)
     
     def angle(self, r, direction=1):
         
@@ -60,7 +213,11 @@ class Stepper:
     
     def reset(self):
         
-        self.pin1(0) 
-        self.pin2(0) 
-        self.pin3(0) 
-        self.pin4(0)
+        if self.direct:
+            machine.mem32[GPIO_OUT_W1TC] = self.coil_mask
+        else:
+            self.pin1(0) 
+            self.pin2(0) 
+            self.pin3(0) 
+            self.pin4(0)
+        self.coils = 0
@@ -0,0 +1,72 @@
+import json
+import os
+
+
+class Syringe:
+    
+    def __init__(self, stepper, steps_per_ml, capacity_ml, path='position.json'):
+        self.stepper = stepper
+        self.phases_per_ml = steps_per_ml * stepper.phases
+        self.capacity_ml = capacity_ml
+        self.path = path
+        self.known = False
+        self.saved = None
+        self.load()
+
+    def load(self):
+        
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            print("No saved syringe position, send set_volume to set it")
+            return
+        if state.get('moving'):
+            
+            print("Syringe position lost during a move, send set_volume to set it")
+            return
+        self.stepper.position = state['position']
+        self.saved = state['position']
+        self.known = True
+        print(f"Syringe holds {self.volume_ml():.2f} ml")
+
+    def save(self, moving=False):
+        
+        if not self.known or (not moving and self.saved == self.stepper.position):
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'position': self.stepper.position, 'moving': moving}, f)
+        os.rename(tmp, self.path)
+        self.saved = None if moving else self.stepper.position
+
+    def volume_ml(self):
+        
+        if not self.known:
+            return None
+        return -self.stepper.position / self.phases_per_ml
+
+    def set_volume(self, ml):
+        
+        if not 0 <= ml <= self.capacity_ml:
+            raise ValueError(f"{ml} ml is outside 0-{self.capacity_ml} ml")
+        self.stepper.position = -round(ml * self.phases_per_ml)
+        self.known = True
+        self.save()
+
+    def check(self, ml_change):
+        
+        if not self.known:
+            return
+        after = self.volume_ml() - ml_change
+        if after < -0.001 or after > self.capacity_ml + 0.001:
+            raise ValueError(f"would leave {after:.2f} ml, outside 0-{self.capacity_ml} ml")
+
+    def change_to(self, ml):
+        
+        if not self.known:
+            raise ValueError("syringe position unknown, send set_volume first")
+        if not 0 <= ml <= self.capacity_ml:
+            raise ValueError(f"{ml} ml is outside 0-{self.capacity_ml} ml")
+        return self.volume_ml() - ml
+
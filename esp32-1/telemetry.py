@@ -0,0 +1,94 @@
+import struct
+from binascii import crc32
+
+
+VERSION = 1
+INDEX = 1
+DATA = 2
+HEADER = "<BBIIB"
+HEADER_SIZE = 11
+MAX_BODY = 250
+RECORD = "<Bh"
+RECORD_SIZE = 3
+
+
+KIND_INT = 1
+KIND_CENTI = 2
+KIND_BOOL = 3
+
+
+def kind_of(value):
+    if isinstance(value, bool):
+        return KIND_BOOL
+    if isinstance(value, int):
+        return KIND_INT
+    return KIND_CENTI
+
+
+class FrameEncoder:
+    
+    def __init__(self, index_every_ms=60000):
+        self.index_every_ms = index_every_ms
+        self.sensors = {}
+        self.table = b''
+        self.table_id = 0
+        self.seq = 0
+        self.index_sent = None
+
+    def register(self, name, value):
+        entry = self.sensors.get(name)
+        if entry is None:
+            if len(self.sensors) == 256:
+                raise ValueError("too many sensors for one index table")
+            entry = (len(self.sensors), kind_of(value))
+            self.sensors[name] = entry
+            encoded = name.encode()
+            self.table += struct.pack("<BBB", entry[0], entry[1], len(encoded)) + encoded
+            self.table_id = crc32(self.table) & 0xffffffff
+            self.index_sent = None
+        return entry
+
+    def resend_index(self):
+        
+        self.index_sent = None
+
+    def frame(self, kind, ticks_ms, body):
+        if len(body) > MAX_BODY:
+            raise ValueError("frame body too large")
+        self.seq = (self.seq + 1) & 0xff
+        return struct.pack(HEADER, VERSION << 4 | kind, self.seq, self.table_id,
+                           ticks_ms & 0xffffffff, len(body)) + body
+
+    def index(self, ticks_ms):
+        
+        self.index_sent = ticks_ms
+        return self.frame(INDEX, ticks_ms, self.table)
+
+    def clock(self, ticks_ms):
+        
+        return self.frame(DATA, ticks_ms, b'')
+
+    def encode(self, values, ticks_ms):
+        
+        records = []
+        for name, value in values.items():
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    records.append((self.register(name + "." + key, item), item))
+            elif value is not None:
+                records.append((self.register(name, value), value))
+
+        body = bytearray(len(records) * RECORD_SIZE)
+        for i, ((index, kind), value) in enumerate(records):
+            if kind == KIND_CENTI:
+                value = round(value * 100)
+            value = max(-32768, min(32767, int(value)))
+            struct.pack_into(RECORD, body, i * RECORD_SIZE, index, value)
+
+        frames = []
+        
+        if self.index_sent is None or (self.index_every_ms and
+                abs(ticks_ms - self.index_sent) >= self.index_every_ms):
+            frames.append(self.index(ticks_ms))
+        frames.append(self.frame(DATA, ticks_ms, body))
+        return frames
@@ -2,9 +2,12 @@ import network
 import espnow
 import time
 import ubinascii
+import uselect
 import json
+import struct
 import re
 from umqtt.simple import MQTTClient
+from spool import Spool, Backoff
 
 
 
@@ -26,11 +29,12 @@ print("IP:", wlan.ifconfig())
 
 
 esp = espnow.ESPNow()
+
+esp.config(rxbuf=4096)
 esp.active(True)
 
 
 ESP32_1_MAC = b'\x24\x6F\x28\xAA\xBB\xCC'
-esp.add_peer(ESP32_1_MAC)
 
 print("ESP-NOW aktiv (ESP32-2)")
 print("ESP32-1 peer:", ubinascii.hexlify(ESP32_1_MAC, ":").decode())
@@ -43,13 +47,231 @@ CLIENT_ID = "esp32_gateway"
 
 TOPIC_SENSOR = b"esp32/sensors"
 TOPIC_COMMAND = b"esp32/command"
+TOPIC_STATS = b"esp32/gateway/stats"
+TOPIC_PEERS = b"esp32/gateway/peers"
+
+
+
+
+
+
+BATCH_MAX_BYTES = 1024
+BATCH_MAX_MS = 100
+DRAIN_MAX = 64
+STATS_INTERVAL_MS = 10000
+
+
+
+
+
+
+
+SPOOL_FILE = "spool.bin"
+SPOOL_RAM_ITEMS = 8
+SPOOL_SLOTS = 64
+SPOOL_SLOT_SIZE = 2048
+SPOOL_DRAIN_BYTES = 4096
+RECONNECT_MIN_MS = 1000
+RECONNECT_MAX_MS = 30000
+MQTT_CONNECT_TIMEOUT = 1
+CLOCK_MAC = b"\x00" * 6
+
+
+def clock_entry():
+    return CLOCK_MAC + b"\x04" + struct.pack("<I", time.ticks_ms())
+
+
+class Batcher:
+    def __init__(self, max_bytes, max_ms):
+        self.max_bytes = max_bytes
+        self.max_ms = max_ms
+        self.buf = bytearray()
+        self.count = 0
+        self.started = None
+        self.stats = {"received": 0, "forwarded": 0, "spooled": 0, "batches": 0}
+
+    def add(self, host, msg):
+        self.stats["received"] += 1
+        if len(self.buf) + 7 + len(msg) > self.max_bytes:
+            self.flush()
+        if self.started is None:
+            self.started = time.ticks_ms()
+        self.buf.extend(host)
+        self.buf.append(len(msg))
+        self.buf.extend(msg)
+        self.count += 1
+
+    def wait_ms(self, limit):
+        
+        if self.started is None:
+            return limit
+        left = self.max_ms - time.ticks_diff(time.ticks_ms(), self.started)
+        return max(0, min(limit, left))
+
+    def due(self):
+        return self.started is not None and self.wait_ms(1) == 0
+
+    def flush(self):
+        if not self.count:
+            return
+        sent = False
+        
+        if mqtt_up and not len(spool):
+            try:
+                mqtt.publish(TOPIC_SENSOR, self.buf)
+                sent = True
+            except Exception as e:
+                print("MQTT send fejl:", e)
+                mqtt_lost()
+        if sent:
+            self.stats["forwarded"] += self.count
+            self.stats["batches"] += 1
+        else:
+            
+            spool.push(clock_entry() + self.buf)
+            self.stats["spooled"] += self.count
+        self.buf = bytearray()
+        self.count = 0
+        self.started = None
+
+
+
+
+
+
+
+
+DEFAULT_TARGET = "esp32-1"
+MAX_PEERS = 20
+PEER_QUEUE_MAX = 8
+RETRY_MS = 50
+MAX_RETRIES = 5
+NAME_MAX = 32
+NAME_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class Peer:
+    def __init__(self, mac, target):
+        self.mac = mac
+        self.target = target
+        self.queue = []
+        self.tries = 0
+        self.retry_at = None
+        self.stats = {"sent": 0, "retries": 0, "failed": 0}
+
+
+def hello_name(raw):
+    
+    
+    if not 0 < len(raw) <= NAME_MAX:
+        return None
+    try:
+        name = raw.decode()
+    except UnicodeError:
+        return None
+    return name if NAME_RE.match(name) else None
+
+
+class PeerTable:
+    def __init__(self):
+        self.by_target = {}
+        self.by_mac = {}
+        self.default = None
+        self.changed = False
+
+    def register(self, mac, target=None):
+        mac = bytes(mac)
+        peer = self.by_mac.get(mac)
+        if peer is not None and (target is None or peer.target == target):
+            return peer
+        target = target or ubinascii.hexlify(mac).decode()
+        if peer is None:
+            if len(self.by_mac) >= MAX_PEERS:
+                return None
+            try:
+                esp.add_peer(mac)
+            except OSError:
+                pass
+            peer = Peer(mac, target)
+            self.by_mac[mac] = peer
+        else:
+            del self.by_target[peer.target]
+            peer.target = target
+        
+        old = self.by_target.get(target)
+        if old is not None and old is not peer:
+            old.target = ubinascii.hexlify(old.mac).decode()
+            self.by_target[old.target] = old
+        self.by_target[target] = peer
+        self.changed = True
+        print("Peer:", target, ubinascii.hexlify(mac, ":").decode())
+        return peer
+
+    def enqueue(self, target, message):
+        peer = self.by_target.get(target) if target else self.default
+        if peer is None or len(peer.queue) >= PEER_QUEUE_MAX:
+            return False
+        peer.queue.append(message)
+        return True
+
+    def pump(self):
+        
+        now = time.ticks_ms()
+        for peer in self.by_mac.values():
+            while peer.queue and (peer.retry_at is None or time.ticks_diff(now, peer.retry_at) >= 0):
+                try:
+                    ok = esp.send(peer.mac, peer.queue[0])
+                except OSError:
+                    ok = False
+                if ok:
+                    peer.queue.pop(0)
+                    peer.stats["sent"] += 1
+                    peer.tries = 0
+                    peer.retry_at = None
+                    continue
+                peer.tries += 1
+                if peer.tries > MAX_RETRIES:
+                    print("Kommando til", peer.target, "opgivet:", peer.queue.pop(0))
+                    peer.stats["failed"] += 1
+                    peer.tries = 0
+                    peer.retry_at = None
+                    continue
+                peer.stats["retries"] += 1
+                peer.retry_at = time.ticks_add(now, RETRY_MS << (peer.tries - 1))
+                break
+
+    def wait_ms(self, limit):
+        
+        now = time.ticks_ms()
+        for peer in self.by_mac.values():
+            if peer.queue:
+                if peer.retry_at is None:
+                    return 0
+                limit = min(limit, max(0, time.ticks_diff(peer.retry_at, now)))
+        return limit
+
+    def announce(self):
+        
+        peers = {p.target: ubinascii.hexlify(p.mac, ":").decode() for p in self.by_mac.values()}
+        try:
+            mqtt.publish(TOPIC_PEERS, json.dumps(peers), True)
+            self.changed = False
+        except Exception as e:
+            print("MQTT send fejl:", e)
+            mqtt_lost()
+
+
+peers = PeerTable()
+peers.default = peers.register(ESP32_1_MAC, DEFAULT_TARGET)
 
 mqtt = MQTTClient(CLIENT_ID, MQTT_BROKER)
 
 def mqtt_callback(topic, msg):
     try:
         message = msg.decode()
-        print("MQTT kommando:", message)
+        
+        target = topic[len(TOPIC_COMMAND) + 1:].decode()
+        print("MQTT kommando:", target or DEFAULT_TARGET, message)
 
         
         
@@ -58,30 +280,145 @@ def mqtt_callback(topic, msg):
             return
 
         
-        esp.send(ESP32_1_MAC, message)
+        if not peers.enqueue(target, message):
+            print("Ukendt peer eller fuld kø – afvist:", target or DEFAULT_TARGET)
 
     except Exception as e:
         print("Fejl i MQTT callback:", e)
 
 mqtt.set_callback(mqtt_callback)
-mqtt.connect()
-mqtt.subscribe(TOPIC_COMMAND)
+mqtt_up = False
+backoff = Backoff(RECONNECT_MIN_MS, RECONNECT_MAX_MS)
+spool = Spool(SPOOL_FILE, SPOOL_RAM_ITEMS, SPOOL_SLOTS, SPOOL_SLOT_SIZE)
+
+def mqtt_connect():
+    
+    global mqtt_up
+    try:
+        if not wlan.isconnected():
+            raise OSError("ingen Wi-Fi")
+        
+        
+        mqtt.connect(timeout=MQTT_CONNECT_TIMEOUT)
+        mqtt.subscribe(TOPIC_COMMAND)
+        mqtt.subscribe(TOPIC_COMMAND + b"/+")
+    except Exception as e:
+        print("MQTT forbindelse fejlede:", e)
+        backoff.failed()
+        return
+    mqtt_up = True
+    backoff.reset()
+    poller.register(mqtt.sock, uselect.POLLIN)
+    peers.changed = True
+    print("MQTT forbundet til Raspberry Pi,", len(spool), "batches venter")
+
+def mqtt_lost():
+    global mqtt_up
+    if mqtt_up:
+        print("MQTT forbindelse tabt, data gemmes til den er tilbage")
+    mqtt_up = False
+    backoff.failed()
+    try:
+        poller.unregister(mqtt.sock)
+    except Exception:
+        pass
+    try:
+        mqtt.sock.close()
+    except Exception:
+        pass
 
-print("MQTT forbundet til Raspberry Pi")
+def send_spooled():
+    
+    chunks = spool.peek(SPOOL_DRAIN_BYTES)
+    try:
+        mqtt.publish(TOPIC_SENSOR, b"".join(chunks) + clock_entry())
+    except Exception as e:
+        print("MQTT send fejl:", e)
+        mqtt_lost()
+        return
+    spool.drop(len(chunks))
 
 
 
-while True:
+
+
+
+
+def drain():
+    
     
-    mqtt.check_msg()
+    for _ in range(DRAIN_MAX):
+        host, msg = esp.recv(0)
+        if not msg:
+            break
+        try:
+            if msg.startswith(b"HELLO:"):
+                name = hello_name(msg[6:])
+                if name is None:
+                    print("Ugyldigt navn i HELLO – afvist:", ubinascii.hexlify(host, ":").decode())
+                else:
+                    peers.register(host, name)
+                continue
+            if host not in peers.by_mac:
+                peers.register(host)
+            batcher.add(host, msg)
+        except Exception as e:
+            print("Fejl i ESP-NOW besked:", e)
+
+
+poller = uselect.poll()
+poller.register(esp, uselect.POLLIN)
+mqtt_connect()
+
+batcher = Batcher(BATCH_MAX_BYTES, BATCH_MAX_MS)
+stats_sent = time.ticks_ms()
+
+while True:
+    if not mqtt_up:
+        limit = backoff.wait_ms(STATS_INTERVAL_MS)
+    elif len(spool):
+        limit = 0
+    else:
+        limit = max(0, STATS_INTERVAL_MS - time.ticks_diff(time.ticks_ms(), stats_sent))
+    timeout = peers.wait_ms(batcher.wait_ms(limit))
+    for obj, event in poller.poll(timeout):
+        if obj is esp:
+            drain()
+        elif event & uselect.POLLIN:
+            
+            try:
+                mqtt.check_msg()
+            except Exception as e:
+                print("MQTT fejl:", e)
+                mqtt_lost()
+        else:
+            
+            mqtt_lost()
+
+    if batcher.due():
+        drain()
+        batcher.flush()
+    poller.modify(esp, 0 if batcher.count else uselect.POLLIN)
+
+    peers.pump()
+    if not mqtt_up:
+        if backoff.due():
+            mqtt_connect()
+        continue
+    if peers.changed:
+        peers.announce()
+    if len(spool):
+        send_spooled()
 
     
-    host, msg = esp.recv()
-    if msg:
+    if time.ticks_diff(time.ticks_ms(), stats_sent) >= STATS_INTERVAL_MS:
+        stats_sent = time.ticks_ms()
+        stats = dict(batcher.stats)
+        stats["rx_dropped"] = esp.stats()[4]
+        stats["spool"] = dict(spool.stats, waiting=len(spool))
+        stats["peers"] = {p.target: p.stats for p in peers.by_mac.values()}
         try:
-            print("ESP-NOW data:", msg)
-            mqtt.publish(TOPIC_SENSOR, msg)
+            mqtt.publish(TOPIC_STATS, json.dumps(stats))
         except Exception as e:
             print("MQTT send fejl:", e)
-
-    time.sleep(0.2)
+            mqtt_lost()
@@ -0,0 +1,108 @@
+import struct
+import time
+
+
+SLOT_HEADER = "<HH"
+
+
+class Spool:
+    
+    def __init__(self, path, ram_max=16, slots=128, slot_size=512):
+        self.ram_max = ram_max
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ram = []
+        self.head = 0
+        self.count = 0
+        self.items = 0
+        self.stats = {"spooled": 0, "spilled": 0, "dropped": 0}
+        self.file = open(path, "w+b")
+
+    def __len__(self):
+        
+        return self.items + len(self.ram)
+
+    def push(self, item):
+        if len(item) + 4 > self.slot_size:
+            self.stats["dropped"] += 1
+            return
+        self.stats["spooled"] += 1
+        self.ram.append(item)
+        if len(self.ram) > self.ram_max:
+            self.spill()
+
+    def spill(self):
+        
+        n = 0
+        size = 4
+        while n < len(self.ram) and size + len(self.ram[n]) <= self.slot_size:
+            size += len(self.ram[n])
+            n += 1
+        if self.count == self.slots:
+            
+            self.stats["dropped"] += self.read_header(0)[1]
+            self.free(1)
+        self.file.seek((self.head + self.count) % self.slots * self.slot_size)
+        self.file.write(struct.pack(SLOT_HEADER, size - 4, n) + b''.join(self.ram[:n]))
+        self.file.flush()
+        del self.ram[:n]
+        self.count += 1
+        self.items += n
+        self.stats["spilled"] += n
+
+    def read_header(self, n):
+        self.file.seek((self.head + n) % self.slots * self.slot_size)
+        return struct.unpack(SLOT_HEADER, self.file.read(4))
+
+    def free(self, n):
+        for _ in range(n):
+            self.items -= self.read_header(0)[1]
+            self.head = (self.head + 1) % self.slots
+            self.count -= 1
+
+    def peek(self, max_bytes):
+        
+        chunks = []
+        size = 0
+        for n in range(self.count + len(self.ram)):
+            if n < self.count:
+                chunk = self.file.read(self.read_header(n)[0])
+            else:
+                chunk = self.ram[n - self.count]
+            if chunks and size + len(chunk) > max_bytes:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return chunks
+
+    def drop(self, n):
+        
+        from_file = min(n, self.count)
+        self.free(from_file)
+        del self.ram[:n - from_file]
+
+
+class Backoff:
+    
+    def __init__(self, first_ms=1000, max_ms=60000):
+        self.first_ms = first_ms
+        self.max_ms = max_ms
+        self.delay_ms = 0
+        self.next_try = None
+
+    def due(self):
+        return self.next_try is None or time.ticks_diff(time.ticks_ms(), self.next_try) >= 0
+
+    def wait_ms(self, limit):
+        if self.next_try is None:
+            return 0
+        return max(0, min(limit, time.ticks_diff(self.next_try, time.ticks_ms())))
+
+    def failed(self):
+        self.delay_ms = min(self.max_ms, self.delay_ms * 2 or self.first_ms)
+        self.next_try = time.ticks_add(time.ticks_ms(), self.delay_ms)
+
+    def reset(self):
+        self.delay_ms = 0
+        self.next_try = None
+
@@ -2,10 +2,56 @@ MQTT_BROKER = "localhost"  # Change to your MQTT broker IP
 MQTT_CLIENT_ID = "rasp_liquid_system"
 MQTT_TOPIC_COMMAND = "liquid_system/command"
 MQTT_TOPIC_STATUS = "liquid_system/status"
-MQTT_TOPIC_LEVEL = "liquid_system/level"
-MQTT_TOPIC_TEMP = "liquid_system/temperature"
+MQTT_TOPIC_TELEMETRY = "liquid_system/telemetry"   # binary frames, see telemetry.py
 
 # Stepper calibration
 # 1 rotation = 509 steps = 3 ml
 # 1 ml = ~170 steps (509/3)
-STEPS_PER_ML = 170
\ No newline at end of file
+STEPS_PER_ML = 170
+
+# Closed-loop dispensing: push until the level sensor shows the volume arrived
+CLOSED_LOOP = False         # default for commands without "closed_loop"
+LEVEL_COUNTS_PER_ML = 50    # photoresistor change per ml in the container (calibrate!)
+LEVEL_LAG_MS = 300          # how far the level reading trails the liquid
+LEVEL_SAMPLE_MS = 20        # level sampling while the motor moves
+CLOSED_LOOP_SLOW_AT = 0.85  # creep once this share of the volume has arrived
+CLOSED_LOOP_MAX_STEPS = 1.3 # never push more than this times the open-loop steps
+
+# Syringe travel limits; the plunger position is kept in POSITION_FILE
+SYRINGE_CAPACITY_ML = 20
+POSITION_FILE = "position.json"
+
+# Stepper speed profile (half-steps/s). Moves start at 1000/delay and ramp
+# up to STEPPER_MAX_HZ; lower these if the motor loses steps under load.
+STEPPER_MAX_HZ = 1700
+STEPPER_ACCEL = 3000        # half-steps/s²
+STEPPER_PROFILE = "trapezoid"  # or "scurve"
+
+# Task periods (ms)
+COMMAND_POLL_MS = 20        # how often the MQTT socket is checked for commands
+LINK_POLL_MS = 50           # reconnect checks and backlog messages
+PROGRESS_INTERVAL_MS = 1000 # dispense progress to MQTT
+
+# Sensor sampling and reporting. Each sensor is read every rate_ms and only
+# published when it moved more than deadband since the last report, or when
+# heartbeat_ms passed without a report.
+SENSOR_SCHEDULES = {
+    "water_level": {"rate_ms": 50, "deadband": 10, "heartbeat_ms": 30000},         # ADC counts
+    "temperature": {"rate_ms": 1000, "deadband": 0.2, "heartbeat_ms": 60000},      # °C
+    "laser_beam_broken": {"rate_ms": 50, "deadband": 0, "heartbeat_ms": 60000},
+}
+TELEMETRY_INDEX_MS = 600000 # resend the sensor index table this often
+
+# Store-and-forward: telemetry that cannot be sent waits in RAM, then in a
+# ring file on flash, and goes out in batches once MQTT is back. The link is
+# retried RECONNECT_MIN_MS after it drops, doubling up to RECONNECT_MAX_MS.
+SPOOL_FILE = "spool.bin"
+SPOOL_RAM_ITEMS = 32
+SPOOL_SLOTS = 128           # flash ring: SPOOL_SLOTS * SPOOL_SLOT_SIZE bytes
+SPOOL_SLOT_SIZE = 512
+SPOOL_DRAIN_BYTES = 1024    # backlog per MQTT message
+RECONNECT_MIN_MS = 1000
+RECONNECT_MAX_MS = 60000
+MQTT_CONNECT_TIMEOUT = 1    # s; connect() blocks the whole loop this long at most
+
+MAX_QUEUED_DISPENSES = 5
@@ -2,9 +2,12 @@ import network
 import espnow
 import time
 import ubinascii
+import uselect
 import json
+import struct
 from umqtt.simple import MQTTClient
 import re
+from spool import Spool, Backoff
 
 
 # Wi-Fi til Raspberry Pi
@@ -26,11 +29,12 @@ print("IP:", wlan.ifconfig())
 # ESP-NOW init
 
 esp = espnow.ESPNow()
+# Plads til et burst fra mange noder (standard er 526 bytes); skal sættes før active()
+esp.config(rxbuf=4096)
 esp.active(True)
 
 # MAC på ESP32-1 (SKAL rettes)
 ESP32_1_MAC = b'\x24\x6F\x28\xAA\xBB\xCC'
-esp.add_peer(ESP32_1_MAC)
 
 print("ESP-NOW aktiv (ESP32-2)")
 print("ESP32-1 peer:", ubinascii.hexlify(ESP32_1_MAC, ":").decode())
@@ -43,13 +47,231 @@ CLIENT_ID = "esp32_gateway"
 
 TOPIC_SENSOR = b"esp32/sensors"
 TOPIC_COMMAND = b"esp32/command"
+TOPIC_STATS = b"esp32/gateway/stats"
+TOPIC_PEERS = b"esp32/gateway/peers"
+
+
+# Batching: alle ventende ESP-NOW beskeder samles og sendes som én MQTT
+# besked. Hver besked i batchen er afsenderens MAC (6 bytes), længden
+# (1 byte) og selve beskeden, så Pi'en kan skelne mange noder fra hinanden.
+
+BATCH_MAX_BYTES = 1024      # send batchen når den når denne størrelse ...
+BATCH_MAX_MS = 100          # ... eller når den ældste besked har ventet så længe
+DRAIN_MAX = 64              # højst så mange beskeder pr. runde, så MQTT ikke sulter
+STATS_INTERVAL_MS = 10000
+
+# Store-and-forward: batches der ikke kan sendes gemmes i RAM og derefter i
+# en ringfil i flash, og sendes når MQTT er tilbage. Forbindelsen prøves igen
+# efter RECONNECT_MIN_MS, fordoblet for hver fejl op til RECONNECT_MAX_MS.
+# En gemt batch starter med et ur-indslag (MAC 00:00:00:00:00:00 og
+# gatewayens ticks_ms), og der sendes et til sidst, så Pi'en kan datere den.
+
+SPOOL_FILE = "spool.bin"
+SPOOL_RAM_ITEMS = 8
+SPOOL_SLOTS = 64            # ringfil: SPOOL_SLOTS * SPOOL_SLOT_SIZE bytes
+SPOOL_SLOT_SIZE = 2048
+SPOOL_DRAIN_BYTES = 4096    # gemte data pr. MQTT besked
+RECONNECT_MIN_MS = 1000
+RECONNECT_MAX_MS = 30000
+MQTT_CONNECT_TIMEOUT = 1    # s; så længe kan connect() højst blokere løkken
+CLOCK_MAC = b"\x00" * 6
+
+
+def clock_entry():
+    return CLOCK_MAC + b"\x04" + struct.pack("<I", time.ticks_ms())
+
+
+class Batcher:
+    def __init__(self, max_bytes, max_ms):
+        self.max_bytes = max_bytes
+        self.max_ms = max_ms
+        self.buf = bytearray()
+        self.count = 0
+        self.started = None     # ticks_ms for den ældste besked
+        self.stats = {"received": 0, "forwarded": 0, "spooled": 0, "batches": 0}
+
+    def add(self, host, msg):
+        self.stats["received"] += 1
+        if len(self.buf) + 7 + len(msg) > self.max_bytes:
+            self.flush()
+        if self.started is None:
+            self.started = time.ticks_ms()
+        self.buf.extend(host)
+        self.buf.append(len(msg))
+        self.buf.extend(msg)
+        self.count += 1
+
+    def wait_ms(self, limit):
+        # Hvor længe der må ventes på radioen før batchen skal sendes
+        if self.started is None:
+            return limit
+        left = self.max_ms - time.ticks_diff(time.ticks_ms(), self.started)
+        return max(0, min(limit, left))
+
+    def due(self):
+        return self.started is not None and self.wait_ms(1) == 0
+
+    def flush(self):
+        if not self.count:
+            return
+        sent = False
+        # Kun direkte ud når intet ældre venter, så rækkefølgen holder
+        if mqtt_up and not len(spool):
+            try:
+                mqtt.publish(TOPIC_SENSOR, self.buf)
+                sent = True
+            except Exception as e:
+                print("MQTT send fejl:", e)
+                mqtt_lost()
+        if sent:
+            self.stats["forwarded"] += self.count
+            self.stats["batches"] += 1
+        else:
+            # Batches kan sættes sammen, så de gemte sendes samlet senere
+            spool.push(clock_entry() + self.buf)
+            self.stats["spooled"] += self.count
+        self.buf = bytearray()
+        self.count = 0
+        self.started = None
+
+
+# Peers: én gateway styrer mange dispensere. En node melder sig med
+# "HELLO:<navn>" og styres derefter på esp32/command/<navn>; andre afsendere
+# registreres automatisk under deres MAC i hex. esp32/command uden navn går
+# stadig til ESP32-1, også hvis den melder sig med et navn. Hver peer har sin egen kø, så en node der ikke svarer
+# ikke holder de andre tilbage.
+
+DEFAULT_TARGET = "esp32-1"
+MAX_PEERS = 20              # ESP-NOW kan højst have 20 peers
+PEER_QUEUE_MAX = 8          # ventende kommandoer pr. peer
+RETRY_MS = 50               # første gensendelse, fordobles for hvert forsøg
+MAX_RETRIES = 5
+NAME_MAX = 32               # navnet bliver en del af et MQTT-emne
+NAME_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class Peer:
+    def __init__(self, mac, target):
+        self.mac = mac
+        self.target = target
+        self.queue = []         # kommandoer der venter på at blive sendt
+        self.tries = 0
+        self.retry_at = None    # ticks_ms for næste forsøg, None = send nu
+        self.stats = {"sent": 0, "retries": 0, "failed": 0}
+
+
+def hello_name(raw):
+    # Navnet fra en HELLO, eller None hvis det ikke kan bruges i et emne:
+    # / + # og ugyldig UTF-8 ville ødelægge routingen
+    if not 0 < len(raw) <= NAME_MAX:
+        return None
+    try:
+        name = raw.decode()
+    except UnicodeError:
+        return None
+    return name if NAME_RE.match(name) else None
+
+
+class PeerTable:
+    def __init__(self):
+        self.by_target = {}
+        self.by_mac = {}
+        self.default = None     # peer for esp32/command uden navn
+        self.changed = False    # listen skal sendes til Pi'en igen
+
+    def register(self, mac, target=None):
+        mac = bytes(mac)
+        peer = self.by_mac.get(mac)
+        if peer is not None and (target is None or peer.target == target):
+            return peer
+        target = target or ubinascii.hexlify(mac).decode()
+        if peer is None:
+            if len(self.by_mac) >= MAX_PEERS:
+                return None
+            try:
+                esp.add_peer(mac)
+            except OSError:
+                pass            # findes allerede i ESP-NOW
+            peer = Peer(mac, target)
+            self.by_mac[mac] = peer
+        else:
+            del self.by_target[peer.target]
+            peer.target = target
+        # En ny node med et navn der er i brug overtager det (udskiftet enhed)
+        old = self.by_target.get(target)
+        if old is not None and old is not peer:
+            old.target = ubinascii.hexlify(old.mac).decode()
+            self.by_target[old.target] = old
+        self.by_target[target] = peer
+        self.changed = True
+        print("Peer:", target, ubinascii.hexlify(mac, ":").decode())
+        return peer
+
+    def enqueue(self, target, message):
+        peer = self.by_target.get(target) if target else self.default
+        if peer is None or len(peer.queue) >= PEER_QUEUE_MAX:
+            return False
+        peer.queue.append(message)
+        return True
+
+    def pump(self):
+        # Send det der venter; esp.send venter på ESP-NOW's ack fra modtageren
+        now = time.ticks_ms()
+        for peer in self.by_mac.values():
+            while peer.queue and (peer.retry_at is None or time.ticks_diff(now, peer.retry_at) >= 0):
+                try:
+                    ok = esp.send(peer.mac, peer.queue[0])
+                except OSError:
+                    ok = False
+                if ok:
+                    peer.queue.pop(0)
+                    peer.stats["sent"] += 1
+                    peer.tries = 0
+                    peer.retry_at = None
+                    continue
+                peer.tries += 1
+                if peer.tries > MAX_RETRIES:
+                    print("Kommando til", peer.target, "opgivet:", peer.queue.pop(0))
+                    peer.stats["failed"] += 1
+                    peer.tries = 0
+                    peer.retry_at = None
+                    continue
+                peer.stats["retries"] += 1
+                peer.retry_at = time.ticks_add(now, RETRY_MS << (peer.tries - 1))
+                break
+
+    def wait_ms(self, limit):
+        # Hvor længe der må sove før en kø skal sendes eller gensendes
+        now = time.ticks_ms()
+        for peer in self.by_mac.values():
+            if peer.queue:
+                if peer.retry_at is None:
+                    return 0
+                limit = min(limit, max(0, time.ticks_diff(peer.retry_at, now)))
+        return limit
+
+    def announce(self):
+        # Navn -> MAC til Pi'en (retained, så den kendes efter en genstart)
+        peers = {p.target: ubinascii.hexlify(p.mac, ":").decode() for p in self.by_mac.values()}
+        try:
+            mqtt.publish(TOPIC_PEERS, json.dumps(peers), True)
+            self.changed = False
+        except Exception as e:
+            print("MQTT send fejl:", e)
+            mqtt_lost()
+
+
+peers = PeerTable()
+peers.default = peers.register(ESP32_1_MAC, DEFAULT_TARGET)
 
 mqtt = MQTTClient(CLIENT_ID, MQTT_BROKER)
 
 def mqtt_callback(topic, msg):
     try:
         message = msg.decode()
-        print("MQTT kommando:", message)
+        # esp32/command går til ESP32-1, esp32/command/<navn> til den peer
+        target = topic[len(TOPIC_COMMAND) + 1:].decode()
+        print("MQTT kommando:", target or DEFAULT_TARGET, message)
 
         # REGEX-VALIDERING
         # Tillad fx: "DISPENSE: "10" eller "25"
@@ -57,31 +279,146 @@ def mqtt_callback(topic, msg):
             print("Ugyldigt kommandoformat – afvist")
             return
 
-        # Send kun gyldige kommandoer videre til ESP32-1
-        esp.send(ESP32_1_MAC, message)
+        # Kun gyldige kommandoer kommer i peerens kø; pump() sender dem
+        if not peers.enqueue(target, message):
+            print("Ukendt peer eller fuld kø – afvist:", target or DEFAULT_TARGET)
 
     except Exception as e:
         print("Fejl i MQTT callback:", e)
 
 mqtt.set_callback(mqtt_callback)
-mqtt.connect()
-mqtt.subscribe(TOPIC_COMMAND)
+mqtt_up = False
+backoff = Backoff(RECONNECT_MIN_MS, RECONNECT_MAX_MS)
+spool = Spool(SPOOL_FILE, SPOOL_RAM_ITEMS, SPOOL_SLOTS, SPOOL_SLOT_SIZE)
 
-print("MQTT forbundet til Raspberry Pi")
+def mqtt_connect():
+    # Forbind og abonnér; fejler det, prøves igen når backoff tillader det
+    global mqtt_up
+    try:
+        if not wlan.isconnected():
+            raise OSError("ingen Wi-Fi")
+        # Uden timeout hænger connect() til TCP giver op, mens ESP-NOW
+        # bufferen løber fuld
+        mqtt.connect(timeout=MQTT_CONNECT_TIMEOUT)
+        mqtt.subscribe(TOPIC_COMMAND)
+        mqtt.subscribe(TOPIC_COMMAND + b"/+")
+    except Exception as e:
+        print("MQTT forbindelse fejlede:", e)
+        backoff.failed()
+        return
+    mqtt_up = True
+    backoff.reset()
+    poller.register(mqtt.sock, uselect.POLLIN)
+    peers.changed = True    # Pi'en kan være genstartet
+    print("MQTT forbundet til Raspberry Pi,", len(spool), "batches venter")
 
-# Main loop
+def mqtt_lost():
+    global mqtt_up
+    if mqtt_up:
+        print("MQTT forbindelse tabt, data gemmes til den er tilbage")
+    mqtt_up = False
+    backoff.failed()
+    try:
+        poller.unregister(mqtt.sock)
+    except Exception:
+        pass
+    try:
+        mqtt.sock.close()
+    except Exception:
+        pass
+
+def send_spooled():
+    # Det gemte sendes lidt ad gangen, så løkken ikke står stille imens
+    chunks = spool.peek(SPOOL_DRAIN_BYTES)
+    try:
+        mqtt.publish(TOPIC_SENSOR, b"".join(chunks) + clock_entry())
+    except Exception as e:
+        print("MQTT send fejl:", e)
+        mqtt_lost()
+        return
+    spool.drop(len(chunks))
+
+# Main loop: sover i poll() indtil MQTT-socketten eller ESP-NOW har data,
+# eller indtil batchen eller tællerne skal sendes. ESP-NOW driveren vækker
+# poll() fra sin modtage-callback. Mens en batch venter, vækkes der ikke for
+# hver ny ESP-NOW besked; de hentes samlet når batchen skal sendes. Uden
+# MQTT gemmes batcherne i spoolen og forbindelsen prøves igen efter backoff.
+
+def drain():
+    # Tøm modtagebufferen (data fra sensornoderne). En besked der fejler
+    # springes over, så én dårlig frame ikke stopper gatewayen.
+    for _ in range(DRAIN_MAX):
+        host, msg = esp.recv(0)
+        if not msg:
+            break
+        try:
+            if msg.startswith(b"HELLO:"):
+                name = hello_name(msg[6:])
+                if name is None:
+                    print("Ugyldigt navn i HELLO – afvist:", ubinascii.hexlify(host, ":").decode())
+                else:
+                    peers.register(host, name)
+                continue
+            if host not in peers.by_mac:
+                peers.register(host)
+            batcher.add(host, msg)
+        except Exception as e:
+            print("Fejl i ESP-NOW besked:", e)
+
+
+poller = uselect.poll()
+poller.register(esp, uselect.POLLIN)
+mqtt_connect()
+
+batcher = Batcher(BATCH_MAX_BYTES, BATCH_MAX_MS)
+stats_sent = time.ticks_ms()
 
 while True:
-    # Tjek MQTT (kommandoer fra Pi)
-    mqtt.check_msg()
+    if not mqtt_up:
+        limit = backoff.wait_ms(STATS_INTERVAL_MS)
+    elif len(spool):
+        limit = 0
+    else:
+        limit = max(0, STATS_INTERVAL_MS - time.ticks_diff(time.ticks_ms(), stats_sent))
+    timeout = peers.wait_ms(batcher.wait_ms(limit))
+    for obj, event in poller.poll(timeout):
+        if obj is esp:
+            drain()
+        elif event & uselect.POLLIN:
+            # Kommando fra Pi
+            try:
+                mqtt.check_msg()
+            except Exception as e:
+                print("MQTT fejl:", e)
+                mqtt_lost()
+        else:
+            # POLLHUP/POLLERR: forbindelsen er tabt, stop med at vække på den
+            mqtt_lost()
 
-    # Tjek ESP-NOW (data fra ESP32-1)
-    host, msg = esp.recv()
-    if msg:
+    if batcher.due():
+        drain()
+        batcher.flush()
+    poller.modify(esp, 0 if batcher.count else uselect.POLLIN)
+
+    peers.pump()
+    if not mqtt_up:
+        if backoff.due():
+            mqtt_connect()
+        continue
+    if peers.changed:
+        peers.announce()
+    if len(spool):
+        send_spooled()
+
+    # Tællere til Pi'en; rx_dropped er beskeder ESP-NOW selv smed (fuld buffer)
+    if time.ticks_diff(time.ticks_ms(), stats_sent) >= STATS_INTERVAL_MS:
+        stats_sent = time.ticks_ms()
+        stats = dict(batcher.stats)
+        stats["rx_dropped"] = esp.stats()[4]
+        stats["spool"] = dict(spool.stats, waiting=len(spool))
+        stats["peers"] = {p.target: p.stats for p in peers.by_mac.values()}
         try:
-            print("ESP-NOW data:", msg)
-            mqtt.publish(TOPIC_SENSOR, msg)
+            mqtt.publish(TOPIC_STATS, json.dumps(stats))
         except Exception as e:
             print("MQTT send fejl:", e)
-
-    time.sleep(0.2)
\ No newline at end of file
+            mqtt_lost()
@@ -1,11 +1,24 @@
 import json
 import time
-from machine import Pin, ADC
 from umqtt.simple import MQTTClient
-from config import MQTT_BROKER, MQTT_CLIENT_ID, MQTT_TOPIC_COMMAND, MQTT_TOPIC_LEVEL, MQTT_TOPIC_TEMP, STEPS_PER_ML
+from config import MQTT_BROKER, MQTT_CLIENT_ID, MQTT_TOPIC_COMMAND, MQTT_TOPIC_TELEMETRY, STEPS_PER_ML
+from config import SENSOR_SCHEDULES, TELEMETRY_INDEX_MS
+from config import MQTT_TOPIC_STATUS, MAX_QUEUED_DISPENSES, PROGRESS_INTERVAL_MS
+from config import STEPPER_MAX_HZ, STEPPER_ACCEL, STEPPER_PROFILE, SYRINGE_CAPACITY_ML, POSITION_FILE
+from config import CLOSED_LOOP, LEVEL_COUNTS_PER_ML, LEVEL_LAG_MS, LEVEL_SAMPLE_MS
+from config import CLOSED_LOOP_SLOW_AT, CLOSED_LOOP_MAX_STEPS
+from config import COMMAND_POLL_MS, LINK_POLL_MS, RECONNECT_MIN_MS, RECONNECT_MAX_MS, MQTT_CONNECT_TIMEOUT
+from config import SPOOL_FILE, SPOOL_RAM_ITEMS, SPOOL_SLOTS, SPOOL_SLOT_SIZE, SPOOL_DRAIN_BYTES
 from stepper import Stepper
-from sensors import TemperatureSensor, PhotoResistor, LaserModule
+from syringe import Syringe
+from sensors import TemperatureSensor, PhotoResistor, LaserModule, SensorSchedule
+from telemetry import FrameEncoder
+from spool import Spool, Backoff
 
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
 
 
 # MQTT Configuration
@@ -17,12 +30,21 @@ class LiquidDispensationSystem:
         self.mqtt_broker = mqtt_broker
         self.client_id = client_id
         self.client = None
+        self.link_up = False
+        self.backoff = Backoff(RECONNECT_MIN_MS, RECONNECT_MAX_MS)
+        self.spool = None               # telemetry waiting for the link
+        self.index_pending = False      # send the index table ahead of the backlog
         self.stepper = None
+        self.syringe = None
         self.temp_sensor = None
         self.photo_resistor = None
         self.laser = None
         self.current_level = 0
         self.is_running = False
+        self.schedules = []
+        self.encoder = FrameEncoder(TELEMETRY_INDEX_MS)
+        self.pending = []               # (ml, direction, target ml, closed loop) for the motor task
+        self.motor_wakeup = asyncio.Event()
         
     def init_components(self):
         """Initialize all hardware components"""
@@ -33,11 +55,12 @@ class LiquidDispensationSystem:
             
             # Initialize Stepper Motor
             print("Initializing Stepper Motor...")
-            in1 = Pin(16, Pin.OUT)
-            in2 = Pin(17, Pin.OUT)
-            in3 = Pin(5, Pin.OUT)
-            in4 = Pin(18, Pin.OUT)
-            self.stepper = Stepper(in1, in2, in3, in4, delay=1, mode=0)
+            # GPIO numbers rather than Pin objects, so the stepper can switch
+            # all four coils in one register write
+            in1, in2, in3, in4 = 16, 17, 5, 18
+            self.stepper = Stepper(in1, in2, in3, in4, delay=1, mode=0, max_hz=STEPPER_MAX_HZ,
+                                   accel=STEPPER_ACCEL, profile=STEPPER_PROFILE)
+            self.syringe = Syringe(self.stepper, STEPS_PER_ML, SYRINGE_CAPACITY_ML, POSITION_FILE)
             print("✓ Stepper Motor initialized")
             
             # Initialize Temperature Sensor
@@ -56,6 +79,21 @@ class LiquidDispensationSystem:
             self.laser.laser_on()
             print("✓ Laser Module initialized")
             
+            # Telemetry that cannot be sent is kept here until the link is back
+            print("Initializing telemetry spool...")
+            self.spool = Spool(SPOOL_FILE, SPOOL_RAM_ITEMS, SPOOL_SLOTS, SPOOL_SLOT_SIZE)
+            print("✓ Telemetry spool initialized")
+            
+            # Temperature update() never waits for the 750 ms conversion, it
+            # returns the cached values and starts a new conversion when due
+            reads = {
+                "temperature": self.temp_sensor.update,
+                "water_level": self.photo_resistor.read,
+                "laser_beam_broken": self.laser.is_beam_broken,
+            }
+            self.schedules = [SensorSchedule(name, reads[name], **SENSOR_SCHEDULES[name])
+                              for name in reads]
+            
             print("\nAll components initialized successfully!\n")
             return True
             
@@ -64,18 +102,36 @@ class LiquidDispensationSystem:
             return False
     
     def connect_mqtt(self):
-        """Connect to MQTT broker"""
+        """Connect to MQTT broker, the next try is put off by the backoff if it fails"""
         try:
             print(f"Connecting to MQTT broker at {self.mqtt_broker}...")
-            self.client = MQTTClient(self.client_id, self.mqtt_broker)
-            self.client.set_callback(self.mqtt_callback)
-            self.client.connect()
+            if self.client is None:
+                self.client = MQTTClient(self.client_id, self.mqtt_broker)
+                self.client.set_callback(self.mqtt_callback)
+            # Without a timeout an unreachable broker stalls every task for
+            # as long as the TCP connect takes to fail
+            self.client.connect(timeout=MQTT_CONNECT_TIMEOUT)
             self.client.subscribe(MQTT_TOPIC_COMMAND)
-            print("✓ Connected to MQTT broker")
+            self.link_up = True
+            self.backoff.reset()
+            print(f"✓ Connected to MQTT broker, {len(self.spool)} telemetry messages waiting")
             return True
         except Exception as e:
             print(f"ERROR: Failed to connect to MQTT: {e}")
+            self.backoff.failed()
             return False
+
+    def link_lost(self):
+        """Mark the MQTT link down; link_task reconnects after the backoff"""
+        if self.link_up:
+            print("MQTT link lost, keeping telemetry until it is back")
+        self.link_up = False
+        self.index_pending = True
+        self.backoff.failed()
+        try:
+            self.client.sock.close()
+        except Exception:
+            pass
     
     def mqtt_callback(self, topic, msg):
         """Handle incoming MQTT messages from flask"""
@@ -86,63 +142,129 @@ class LiquidDispensationSystem:
             # Parse JSON command
             try:
                 cmd = json.loads(message)
+                if not isinstance(cmd, dict):
+                    cmd = {'ml': cmd}
+                command = cmd.get('command')
+                # The dispatcher's commands.id, echoed in the status of the dispense
+                command_id = cmd.get('id')
+                if command in ('stop', 'abort'):
+                    self.abort()
+                    return
+                if command == 'set_volume':
+                    # The syringe holds this much right now
+                    if self.stepper.busy or self.pending:
+                        print("Can't set the syringe volume while dispensing")
+                        return
+                    ml = float(cmd['ml'])
+                    if not 0 <= ml <= SYRINGE_CAPACITY_ML:
+                        print(f"Syringe volume {ml} ml is out of range")
+                        return
+                    self.syringe.set_volume(ml)
+                    print(f"Syringe volume set to {self.syringe.volume_ml():.2f} ml")
+                    return
+                if command == 'goto':
+                    # Absolute move: leave the syringe holding this much
+                    self.request_dispense(0, target=float(cmd['ml']), command_id=command_id)
+                    return
                 ml_amount = float(cmd.get('ml', 0))
                 direction = int(cmd.get('direction', 1))  # 1=push, -1=pull
+                closed_loop = bool(cmd.get('closed_loop', CLOSED_LOOP))
                 
                 if ml_amount > 0:
-                    self.dispense_liquid(ml_amount, direction)
+                    self.request_dispense(ml_amount, direction, closed_loop=closed_loop, command_id=command_id)
                 else:
                     print("Invalid ml amount")
                     
-            except json.JSONDecodeError:
+            except ValueError:
+                # MicroPython's json has no JSONDecodeError; it raises ValueError
+                if message.strip().lower() in ('stop', 'abort'):
+                    self.abort()
+                    return
                 # Try simple number format
                 try:
                     ml_amount = float(message)
-                    self.dispense_liquid(ml_amount, direction=1)
+                    self.request_dispense(ml_amount, direction=1)
                 except ValueError:
                     print(f"Could not parse command: {message}")
                     
         except Exception as e:
             print(f"ERROR in callback: {e}")
     
-    def dispense_liquid(self, ml_amount, direction=1):
+    def request_dispense(self, ml_amount, direction=1, target=None, closed_loop=CLOSED_LOOP, command_id=None):
+        """Queue a dispense (or a move to an absolute target volume) and return at once"""
+        if len(self.pending) >= MAX_QUEUED_DISPENSES:
+            print("⚠️  Too many dispenses queued, command dropped")
+            self.publish_rejected(ml_amount, direction, "too many dispenses queued", command_id)
+            return
+        self.pending.append((ml_amount, direction, target, closed_loop, command_id))
+        self.motor_wakeup.set()
+
+    def abort(self):
+        """Stop the motor now and drop every queued dispense"""
+        print("⚠️  Abort: stopping motor")
+        self.pending = []
+        self.stepper.stop()
+
+    async def dispense_liquid(self, ml_amount, direction=1, closed_loop=False, command_id=None):
         """
         Dispense specified amount of liquid
         direction: 1 = push (dispense), -1 = pull (draw)
+        closed_loop: push until the level sensor shows ml_amount arrived
+        (drawing is always open loop)
+        command_id: the dispatcher's id, sent back with the result
         """
         if self.is_running:
             print("⚠️  System already running, please wait...")
             return
         
+        try:
+            # Soft travel limits, checked against the position after any
+            # moves that ran before this one
+            self.syringe.check(ml_amount * direction)
+        except ValueError as e:
+            print(f"Rejected {ml_amount} ml: {e}")
+            self.publish_rejected(ml_amount, direction, str(e), command_id)
+            return
+        
         self.is_running = True
-        steps = int(ml_amount * STEPS_PER_ML)
+        steps = round(ml_amount * STEPS_PER_ML)
         
         print(f"\n{'='*60}")
         print(f"Dispensing {ml_amount} ml ({steps} steps)...")
         print(f"Direction: {'PUSH (dispense)' if direction > 0 else 'PULL (draw)'}")
+        closed_loop = closed_loop and direction > 0
+        if closed_loop:
+            print("Mode: closed loop (level sensor feedback)")
         print(f"{'='*60}\n")
         
         try:
             # Record initial water level
-            initial_level = self.photo_resistor.read()
+            initial_level = self.photo_resistor.read_median()
             print(f"Initial water level: {initial_level}")
             
-            # Run stepper
-            if direction > 0:
-                self.stepper.step(steps, direction=1)
+            # Run stepper in the background, reporting progress while it moves
+            start = self.stepper.position
+            self.syringe.save(moving=True)
+            if closed_loop:
+                result = await self.closed_loop_move(ml_amount, steps, initial_level)
             else:
-                self.stepper.step(steps, direction=-1)
+                result = await self.open_loop_move(ml_amount, steps, direction)
+            moved = abs(self.stepper.position - start) // self.stepper.phases
+            self.syringe.save()
+            print(f"Moved {moved} of {steps} steps: {result}")
             
-            time.sleep(1)
+            await asyncio.sleep(1)
             
             # Record final water level
-            final_level = self.photo_resistor.read()
+            final_level = self.photo_resistor.read_median()
             displacement = final_level - initial_level
             print(f"Final water level: {final_level}")
             print(f"Water level change: {displacement}")
             
             # Publish results to flask
-            self.publish_status(ml_amount, initial_level, final_level, displacement)
+            self.publish_status(ml_amount, initial_level, final_level, displacement,
+                                dispensed=round(direction * moved / STEPS_PER_ML, 3), aborted=result == 'aborted',
+                                result=result, closed_loop=closed_loop, id=command_id)
             
         except Exception as e:
             print(f"ERROR during dispensing: {e}")
@@ -150,79 +272,231 @@ class LiquidDispensationSystem:
             self.is_running = False
             print("✓ Dispensing complete\n")
     
-    def sensor_reader_loop(self):
-        """Read all sensors and return data"""
-        data = {}
-        
+    async def open_loop_move(self, ml_amount, steps, direction):
+        """Move the counted steps; returns 'done' or 'aborted'"""
+        start = self.stepper.position
+        self.stepper.move(steps, direction=1 if direction > 0 else -1)
+        last_report = time.ticks_ms()
+        while self.stepper.busy:
+            await asyncio.sleep_ms(COMMAND_POLL_MS)
+            if time.ticks_diff(time.ticks_ms(), last_report) >= PROGRESS_INTERVAL_MS:
+                last_report = time.ticks_ms()
+                self.publish_progress(ml_amount)
+        moved = abs(self.stepper.position - start) // self.stepper.phases
+        return 'done' if moved >= steps else 'aborted'
+
+    async def closed_loop_move(self, ml_amount, steps, initial_level):
+        """
+        Push until the level sensor shows ml_amount arrived.
+        Full speed until CLOSED_LOOP_SLOW_AT of it has arrived (or been
+        pushed), then creep at start speed and stop once the reading, plus
+        what is still on its way to the sensor, reaches the goal.
+        Returns 'arrived', 'overflow' (laser beam broken), 'limit' or 'aborted'.
+        """
+        stepper = self.stepper
+        start = stepper.position
+        limit = round(steps * CLOSED_LOOP_MAX_STEPS)
+        # The extra push must not go past the empty point of the syringe
+        volume = self.syringe.volume_ml()
+        if volume is not None:
+            limit = min(limit, int(volume * STEPS_PER_ML))
+        creep_hz = stepper.ramp[0]
+        # ml pushed at creep speed while the reading trails the liquid: the
+        # sensor lag plus the delay of the EMA below
+        smoothing = 0.3
+        lag_ms = LEVEL_LAG_MS + LEVEL_SAMPLE_MS * (1 / smoothing - 1)
+        lag_ml = creep_hz / self.syringe.phases_per_ml * lag_ms / 1000
+        level = initial_level
+
+        stepper.move(limit)
+        result = None
+        last_report = time.ticks_ms()
+        while stepper.busy:
+            await asyncio.sleep_ms(LEVEL_SAMPLE_MS)
+            level += (self.photo_resistor.read_median() - level) * smoothing
+            arrived = (level - initial_level) / LEVEL_COUNTS_PER_ML
+            if self.laser.is_beam_broken():
+                result = 'overflow'
+            elif arrived >= ml_amount - (lag_ml if stepper.speed_limit else 0):
+                result = 'arrived'
+            if result:
+                stepper.stop()
+                break
+
+            pushed = (stepper.position - start) / self.syringe.phases_per_ml
+            if not stepper.speed_limit and max(arrived, pushed) >= ml_amount * CLOSED_LOOP_SLOW_AT:
+                stepper.speed_limit = creep_hz
+            if time.ticks_diff(time.ticks_ms(), last_report) >= PROGRESS_INTERVAL_MS:
+                last_report = time.ticks_ms()
+                self.publish_progress(ml_amount)
+        stepper.speed_limit = 0
+
+        if result is None:
+            moved = (stepper.position - start) // stepper.phases
+            result = 'limit' if moved >= limit else 'aborted'
+        if result != 'arrived':
+            print(f"⚠️  Closed-loop dispense ended: {result}")
+        return result
+
+    def publish_status(self, ml_amount, initial_level, final_level, displacement, **extra):
+        """Publish the result of a dispense to flask"""
+        if not self.link_up:
+            return
+        status = {
+            'state': 'done',
+            'ml': ml_amount,
+            'initial_level': initial_level,
+            'final_level': final_level,
+            'displacement': displacement,
+            'position': self.stepper.position,
+            'volume': self.syringe.volume_ml()
+        }
+        status.update(extra)
+        self.client.publish(MQTT_TOPIC_STATUS, json.dumps(status))
+
+    def publish_progress(self, ml_amount):
+        """Publish how far the running dispense has got"""
+        if not self.link_up:
+            return
         try:
-            # Temperature
-            temps = self.temp_sensor.read_all()
-            data['temperature'] = temps
-            
-            # Water level (photoresistor)
-            data['water_level'] = self.photo_resistor.read()
-            
-            # Laser beam status
-            data['laser_beam_broken'] = self.laser.is_beam_broken()
-            
-            return data
+            self.client.publish(MQTT_TOPIC_STATUS, json.dumps({
+                'state': 'dispensing',
+                'ml': ml_amount,
+                'progress': round(self.stepper.progress(), 3),
+                'position': self.stepper.position,
+                'volume': self.syringe.volume_ml(),
+                'queued': len(self.pending)
+            }))
         except Exception as e:
-            print(f"ERROR reading sensors: {e}")
-            return None
-    
-    def network_sender_loop(self):
-        """Send sensor data to MQTT"""
+            print(f"ERROR publishing progress: {e}")
+            self.link_lost()
+
+    def publish_rejected(self, ml_amount, direction, reason, command_id=None):
+        """Tell flask a dispense was refused"""
+        if not self.link_up:
+            return
         try:
-            data = self.sensor_reader_loop()
-            if data and self.client:
-                water_level = data["water_level"]
-                temperature = data["temperature"]
-                
-                # Publish water level
-                if water_level is not None:
-                    self.client.publish(MQTT_TOPIC_LEVEL, str(water_level))
-                
-                # Publish temperature
-                if temperature:
-                    temp_str = json.dumps(temperature)
-                    self.client.publish(MQTT_TOPIC_TEMP, temp_str)
+            self.client.publish(MQTT_TOPIC_STATUS, json.dumps({
+                'state': 'rejected',
+                'id': command_id,
+                'ml': ml_amount * direction,
+                'volume': self.syringe.volume_ml(),
+                'error': reason
+            }))
+        except Exception as e:
+            print(f"ERROR publishing status: {e}")
+            self.link_lost()
+
+    def publish_telemetry(self, values):
+        """Publish sensor values as binary frames, or spool them while the link is down"""
+        frames = b''.join(self.encoder.encode(values, time.ticks_ms()))
+        # Straight out only when nothing older is waiting, so the order holds
+        if self.link_up and not len(self.spool):
+            try:
+                self.client.publish(MQTT_TOPIC_TELEMETRY, frames)
+                return
+            except Exception as e:
+                print(f"ERROR publishing telemetry: {e}")
+                self.link_lost()
+        self.spool.push(frames)
+
+    def drain_spool(self):
+        """Publish the oldest spooled telemetry as one message"""
+        chunks = self.spool.peek(SPOOL_DRAIN_BYTES)
+        now = time.ticks_ms()
+        # The index may have been overwritten in the spool, and the clock
+        # frame at the end is what the server dates the backlog from
+        head = self.encoder.index(now) if self.index_pending and self.encoder.table else b''
+        try:
+            self.client.publish(MQTT_TOPIC_TELEMETRY, head + b''.join(chunks) + self.encoder.clock(now))
         except Exception as e:
-            print(f"ERROR in network sender: {e}")
+            print(f"ERROR publishing spooled telemetry: {e}")
+            self.link_lost()
+            return
+        self.spool.drop(len(chunks))
+        self.index_pending = False
+
+    async def sensor_task(self):
+        """Sample each sensor on its own schedule, publish only what changed"""
+        while True:
+            report = []
+            for schedule in self.schedules:
+                if schedule.until_due():
+                    continue
+                try:
+                    schedule.sample()
+                except Exception as e:
+                    print(f"ERROR reading {schedule.name}: {e}")
+                    continue
+                if schedule.should_report():
+                    report.append(schedule)
+            # Everything that changed this round goes out in one frame, or
+            # into the spool if it cannot go out now
+            if report:
+                self.publish_telemetry({schedule.name: schedule.value for schedule in report})
+                for schedule in report:
+                    schedule.mark_reported()
+            await asyncio.sleep_ms(min(schedule.until_due() for schedule in self.schedules))
     
+    async def command_task(self):
+        """Check for MQTT commands every COMMAND_POLL_MS"""
+        while True:
+            if self.link_up:
+                try:
+                    self.client.check_msg()
+                except Exception as e:
+                    print(f"MQTT check error: {e}")
+                    self.link_lost()
+            await asyncio.sleep_ms(COMMAND_POLL_MS)
+
+    async def link_task(self):
+        """Reconnect with backoff while the link is down, then send the spooled telemetry"""
+        while True:
+            if not self.link_up:
+                # connect() blocks the loop for up to MQTT_CONNECT_TIMEOUT, so not while the motor runs
+                if self.backoff.due() and not self.stepper.busy:
+                    self.connect_mqtt()
+            elif len(self.spool):
+                self.drain_spool()
+            await asyncio.sleep_ms(LINK_POLL_MS)
+
+    async def motor_task(self):
+        """Run the dispenses handed over by the command task"""
+        while True:
+            await self.motor_wakeup.wait()
+            self.motor_wakeup.clear()
+            while self.pending:
+                ml_amount, direction, target, closed_loop, command_id = self.pending.pop(0)
+                if target is not None:
+                    # One direct move from wherever the earlier moves left it
+                    try:
+                        change = self.syringe.change_to(target)
+                    except ValueError as e:
+                        print(f"Rejected move to {target} ml: {e}")
+                        self.publish_rejected(target, 1, str(e), command_id)
+                        continue
+                    ml_amount = abs(change)
+                    direction = 1 if change > 0 else -1
+                    if ml_amount * STEPS_PER_ML < 1:
+                        print(f"Already at {target} ml")
+                        continue
+                await self.dispense_liquid(ml_amount, direction, closed_loop, command_id)
+
+    async def main_tasks(self):
+        """Start the tasks; the motor task runs in this one"""
+        self.connect_mqtt()
+        asyncio.create_task(self.command_task())
+        asyncio.create_task(self.link_task())
+        asyncio.create_task(self.sensor_task())
+        print("✓ Main loop started\n")
+        await self.motor_task()
+
     def run(self):
         """Main event loop"""
         print("\nStarting main event loop...")
         
-        mqtt_connected = self.connect_mqtt()
-        
-        sensor_timer = 0
-        network_timer = 0
-        
-        print("✓ Main loop started\n")
-        
         try:
-            while True:
-                # Check MQTT messages (handle commands)
-                if mqtt_connected:
-                    try:
-                        self.client.check_msg()
-                    except Exception as e:
-                        print(f"MQTT check error: {e}")
-                
-                # Read sensors every 50ms
-                sensor_timer += 100
-                if sensor_timer >= 50:
-                    data = self.sensor_reader_loop()
-                    sensor_timer = 0
-                
-                # Send to MQTT every 2 seconds
-                network_timer += 100
-                if network_timer >= 2000:
-                    self.network_sender_loop()
-                    network_timer = 0
-                
-                time.sleep_ms(100)  # Check every 100ms
-                
+            asyncio.run(self.main_tasks())
         except KeyboardInterrupt:
             print("\n\nProgram interrupted by user")
             self.shutdown()
@@ -231,9 +505,10 @@ class LiquidDispensationSystem:
         """Clean shutdown of all components"""
         print("Shutting down system...")
         
-        # Reset stepper
+        # Stop and reset stepper, remember where the plunger is
         if self.stepper:
-            self.stepper.reset()
+            self.stepper.stop()
+            self.syringe.save()
         
         # Turn off laser
         if self.laser:
@@ -1,47 +1,161 @@
 import time
 import machine
+from array import array
+from ubinascii import hexlify
 from machine import Pin, ADC
 import onewire
 import ds18x20
 
 class TemperatureSensor:
     """DS18X20 One-Wire Temperature Sensor"""
-    def __init__(self, pin):
+    CONVERSION_MS = 750  # 12-bit conversion time
+
+    def __init__(self, pin, interval_ms=1000):
         ds_pin = machine.Pin(pin)
         self.ds_sensor = ds18x20.DS18X20(onewire.OneWire(ds_pin))
         self.roms = self.ds_sensor.scan()
+        self.interval_ms = interval_ms
+        self.temperatures = {}  # last good value per sensor, keyed by ROM id in hex
+        self.updated = None     # ticks_ms of the last good value
+        self.started = None     # ticks_ms of the conversion in progress
+        self.last_start = None
         print('Found DS devices: ', self.roms)
-    
-    def read_all(self):
-        """Read temperature from all sensors"""
+
+    def start_conversion(self):
+        """Start a conversion on all sensors and return immediately"""
         self.ds_sensor.convert_temp()
-        time.sleep_ms(750)
-        temperatures = {}
+        self.started = self.last_start = time.ticks_ms()
+
+    def conversion_ready(self):
+        """True once the conversion in progress has had time to finish"""
+        return (self.started is not None and
+                time.ticks_diff(time.ticks_ms(), self.started) >= self.CONVERSION_MS)
+
+    def collect(self):
+        """Read a finished conversion into the cache, returns False if none was ready"""
+        if not self.conversion_ready():
+            return False
+        self.started = None
+        good = False
         for rom in self.roms:
-            temperatures[str(rom)] = self.ds_sensor.read_temp(rom)
-        return temperatures
+            try:
+                value = self.ds_sensor.read_temp(rom)
+            except Exception as e:
+                print(f"Temperature read failed: {e}")
+                continue
+            # 85.0 is the power-on scratchpad value, not a measurement
+            if value is None or value == 85.0:
+                continue
+            self.temperatures[hexlify(rom).decode()] = value
+            good = True
+        if good:
+            self.updated = time.ticks_ms()
+        return True
+
+    def update(self):
+        """Non-blocking tick: collect a finished conversion, start the next one when due"""
+        self.collect()
+        if self.started is None and (self.last_start is None or
+                time.ticks_diff(time.ticks_ms(), self.last_start) >= self.interval_ms):
+            self.start_conversion()
+        return self.temperatures
+
+    def age_ms(self):
+        """Milliseconds since the cached values were read, None before the first one"""
+        if self.updated is None:
+            return None
+        return time.ticks_diff(time.ticks_ms(), self.updated)
+
+    def read_all(self):
+        """Blocking read of all sensors (waits for a full conversion)"""
+        self.start_conversion()
+        time.sleep_ms(self.CONVERSION_MS)
+        self.collect()
+        return self.temperatures
+
+
+class FilteredADC:
+    """
+    ADC channel read in bursts. Each burst is sorted into a preallocated
+    buffer and its median feeds an integer EMA (1/16 counts). Nothing is
+    allocated per read, so it can run often without GC pauses.
+    """
+    def __init__(self, adc, burst=8, shift=2):
+        self.adc = adc
+        self.burst = burst
+        self.scratch = array('H', [0] * burst)  # current burst, sorted
+        self.shift = shift      # EMA weight 1/2**shift
+        self.ema = -1
+        self.median = 0         # median of the last burst
+        self.spread = 0         # interquartile range of the last burst
+
+    def sample(self):
+        """Read one burst and return the filtered value"""
+        scratch = self.scratch
+        n = self.burst
+        for i in range(n):
+            v = self.adc.read()
+            # Insertion sort as the burst comes in
+            j = i
+            while j > 0 and scratch[j - 1] > v:
+                scratch[j] = scratch[j - 1]
+                j -= 1
+            scratch[j] = v
+
+        self.median = scratch[n >> 1]
+        self.spread = scratch[(3 * n) >> 2] - scratch[n >> 2]
+        if self.ema < 0:
+            self.ema = self.median << 4
+        else:
+            self.ema += ((self.median << 4) - self.ema) >> self.shift
+        return (self.ema + 8) >> 4
+
+    def value(self):
+        """Filtered value without taking a new burst"""
+        return (self.ema + 8) >> 4
+
+    def quality(self):
+        """0-100 from the spread of the last burst: 100 = all reads agree, 50 = 32 counts"""
+        return 100 * 32 // (32 + self.spread)
 
 
 class PhotoResistor:
     """LDR (Light Dependent Resistor) Sensor"""
-    def __init__(self, pin):
+    def __init__(self, pin, burst=8):
         self.ldr = ADC(Pin(pin))
         self.ldr.atten(ADC.ATTN_11DB)  # full range 0–3.3V
         self.ldr.width(ADC.WIDTH_12BIT)
+        self.filter = FilteredADC(self.ldr, burst)
     
     def read(self):
-        """Read LDR value (0-4095). High = dark, Low = bright"""
+        """Read filtered LDR value (0-4095). High = dark, Low = bright"""
+        return self.filter.sample()
+
+    def read_raw(self):
+        """Single unfiltered ADC read"""
         return self.ldr.read()
 
+    def read_median(self):
+        """Median of one burst: no EMA lag, still ignores single-read spikes"""
+        self.filter.sample()
+        return self.filter.median
+
+    def quality(self):
+        """0-100, how much the reads of the last burst agreed"""
+        return self.filter.quality()
+
 
 class LaserModule:
     """Laser with LDR break-beam detector"""
-    def __init__(self, laser_pin, ldr_pin, threshold=4000):
+    def __init__(self, laser_pin, ldr_pin, threshold=4000, hysteresis=100):
         self.laser = Pin(laser_pin, Pin.OUT)
         self.ldr = ADC(Pin(ldr_pin))
         self.ldr.atten(ADC.ATTN_11DB)
         self.ldr.width(ADC.WIDTH_12BIT)
+        self.filter = FilteredADC(self.ldr, burst=5)
         self.threshold = threshold
+        self.hysteresis = hysteresis
+        self.broken = False
     
     def laser_on(self):
         """Turn on laser"""
@@ -52,6 +166,71 @@ class LaserModule:
         self.laser.off()
     
     def is_beam_broken(self):
-        """Check if laser beam is broken"""
-        value = self.ldr.read()
-        return value > self.threshold
\ No newline at end of file
+        """Check if laser beam is broken.
+        Uses the burst median (no EMA lag) and breaks above threshold but
+        only clears below threshold - hysteresis, so it doesn't flicker.
+        """
+        self.filter.sample()
+        value = self.filter.median
+        if self.broken:
+            if value < self.threshold - self.hysteresis:
+                self.broken = False
+        elif value > self.threshold:
+            self.broken = True
+        return self.broken
+
+
+class SensorSchedule:
+    """When to sample a sensor and when its value is worth publishing.
+
+    A value is reported when it moved more than deadband since the last
+    report, or when heartbeat_ms passed without one, so a quiet sensor
+    still shows it is alive.
+    """
+    def __init__(self, name, read, rate_ms, deadband=0, heartbeat_ms=60000):
+        self.name = name
+        self.read = read
+        self.rate_ms = rate_ms
+        self.deadband = deadband
+        self.heartbeat_ms = heartbeat_ms
+        self.deadline = time.ticks_ms()
+        self.value = None
+        self.reported = None        # value at the last report
+        self.reported_at = None     # ticks_ms of the last report
+
+    def until_due(self):
+        """Milliseconds until the next sample, 0 if it is due"""
+        return max(0, time.ticks_diff(self.deadline, time.ticks_ms()))
+
+    def sample(self):
+        """Read the sensor and move the deadline on by one period"""
+        self.value = self.read()
+        now = time.ticks_ms()
+        self.deadline = time.ticks_add(self.deadline, self.rate_ms)
+        if time.ticks_diff(self.deadline, now) < 0:
+            # Overran a whole period: skip it instead of bursting to catch up
+            self.deadline = time.ticks_add(now, self.rate_ms)
+        return self.value
+
+    def changed(self):
+        """True if the value moved past the deadband since the last report"""
+        old, new = self.reported, self.value
+        if isinstance(new, dict):
+            if not isinstance(old, dict) or len(old) != len(new):
+                return True
+            return any(k not in old or abs(new[k] - old[k]) > self.deadband for k in new)
+        if isinstance(new, bool) or old is None or new is None:
+            return new != old
+        return abs(new - old) > self.deadband
+
+    def should_report(self):
+        if self.value is None or self.value == {}:
+            return False
+        if self.reported_at is None or self.changed():
+            return True
+        return time.ticks_diff(time.ticks_ms(), self.reported_at) >= self.heartbeat_ms
+
+    def mark_reported(self):
+        # Temperatures come back as the sensor's own dict, keep a copy
+        self.reported = dict(self.value) if isinstance(self.value, dict) else self.value
+        self.reported_at = time.ticks_ms()
@@ -0,0 +1,120 @@
+import struct
+import time
+
+
+SLOT_HEADER = "<HH"  # each slot: bytes u16, items u16, the items joined, padding
+
+
+class Spool:
+    """Bounded store-and-forward queue for messages that could not be sent.
+
+    The newest ram_max items stay in RAM. When RAM is full the oldest items
+    are spilled, as many as fit in one slot, to a ring file on flash of
+    `slots` fixed slots of slot_size bytes; when that is full too the oldest
+    slot is overwritten and its items counted as dropped, so the spool never
+    grows past its bounds. Items must stay valid when joined, like telemetry
+    frames or gateway batch entries, since a slot comes back as one chunk.
+    Chunks come back oldest first. peek() and drop() must not be separated
+    by an await, or a push in between could move the chunks peek() returned.
+    The file is started empty on every boot: ticks_ms restarts with the
+    board, so items from before a reboot could not be dated any more.
+    """
+    def __init__(self, path, ram_max=16, slots=128, slot_size=512):
+        self.ram_max = ram_max
+        self.slots = slots
+        self.slot_size = slot_size
+        self.ram = []
+        self.head = 0           # oldest slot in the file
+        self.count = 0          # slots in use
+        self.items = 0          # items in those slots
+        self.stats = {"spooled": 0, "spilled": 0, "dropped": 0}
+        self.file = open(path, "w+b")
+
+    def __len__(self):
+        """Items waiting"""
+        return self.items + len(self.ram)
+
+    def push(self, item):
+        if len(item) + 4 > self.slot_size:
+            self.stats["dropped"] += 1
+            return
+        self.stats["spooled"] += 1
+        self.ram.append(item)
+        if len(self.ram) > self.ram_max:
+            self.spill()
+
+    def spill(self):
+        # One flash write for as many of the oldest RAM items as fit in a slot
+        n = 0
+        size = 4
+        while n < len(self.ram) and size + len(self.ram[n]) <= self.slot_size:
+            size += len(self.ram[n])
+            n += 1
+        if self.count == self.slots:
+            # Full: the oldest slot makes room for these
+            self.stats["dropped"] += self.read_header(0)[1]
+            self.free(1)
+        self.file.seek((self.head + self.count) % self.slots * self.slot_size)
+        self.file.write(struct.pack(SLOT_HEADER, size - 4, n) + b''.join(self.ram[:n]))
+        self.file.flush()
+        del self.ram[:n]
+        self.count += 1
+        self.items += n
+        self.stats["spilled"] += n
+
+    def read_header(self, n):
+        self.file.seek((self.head + n) % self.slots * self.slot_size)
+        return struct.unpack(SLOT_HEADER, self.file.read(4))
+
+    def free(self, n):
+        for _ in range(n):
+            self.items -= self.read_header(0)[1]
+            self.head = (self.head + 1) % self.slots
+            self.count -= 1
+
+    def peek(self, max_bytes):
+        """The oldest chunks that fit in max_bytes together, at least one"""
+        chunks = []
+        size = 0
+        for n in range(self.count + len(self.ram)):
+            if n < self.count:
+                chunk = self.file.read(self.read_header(n)[0])
+            else:
+                chunk = self.ram[n - self.count]
+            if chunks and size + len(chunk) > max_bytes:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+        return chunks
+
+    def drop(self, n):
+        """Forget the n oldest chunks, once they have been sent"""
+        from_file = min(n, self.count)
+        self.free(from_file)
+        del self.ram[:n - from_file]
+
+
+class Backoff:
+    """When to try a lost connection again: first_ms after the first failure,
+    doubling with every failure after that up to max_ms."""
+    def __init__(self, first_ms=1000, max_ms=60000):
+        self.first_ms = first_ms
+        self.max_ms = max_ms
+        self.delay_ms = 0
+        self.next_try = None    # ticks_ms of the next attempt, None = now
+
+    def due(self):
+        return self.next_try is None or time.ticks_diff(time.ticks_ms(), self.next_try) >= 0
+
+    def wait_ms(self, limit):
+        if self.next_try is None:
+            return 0
+        return max(0, min(limit, time.ticks_diff(self.next_try, time.ticks_ms())))
+
+    def failed(self):
+        self.delay_ms = min(self.max_ms, self.delay_ms * 2 or self.first_ms)
+        self.next_try = time.ticks_add(time.ticks_ms(), self.delay_ms)
+
+    def reset(self):
+        self.delay_ms = 0
+        self.next_try = None
@@ -1,9 +1,47 @@
+import sys
 import time
-from machine import Pin
+import machine
+import micropython
+from machine import Pin, Timer
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+# GPIO_OUT_W1TS / GPIO_OUT_W1TC: writing a mask sets / clears those pins (0-31).
+# Only chips whose GPIO block is known; on any other (C6, C5, H2, ...) the
+# registers are None and the stepper writes its Pin objects instead.
+_GPIO_BASE = {
+    'ESP32': 0x3FF44000,
+    'ESP32S2': 0x3F404000,
+    'ESP32S3': 0x60004000,
+    'ESP32C3': 0x60004000,
+}
+# sys.implementation._machine reads like "Generic ESP32S3 module with ESP32S3"
+_CHIP = getattr(sys.implementation, '_machine', '').split(' with ')[-1]
+if _CHIP in _GPIO_BASE:
+    GPIO_OUT_W1TS = _GPIO_BASE[_CHIP] + 0x08
+    GPIO_OUT_W1TC = _GPIO_BASE[_CHIP] + 0x0C
+else:
+    GPIO_OUT_W1TS = GPIO_OUT_W1TC = None
 
 
 class Stepper:
-    """Stepper motor controller for 28BYJ-48 with ULN2003 driver"""
+    """Stepper motor controller for 28BYJ-48 with ULN2003 driver.
+
+    Moves run in the background: a one-shot hardware timer outputs a phase
+    and re-arms itself for the next one, so move() returns at once and the
+    caller stays responsive. Each move starts at 1000/delay phases/s and,
+    with max_hz and accel set, ramps up to max_hz and back down before the
+    end (trapezoid or S-curve).
+
+    Pass GPIO numbers (below 32) instead of Pin objects and each phase is
+    written to all four coils at once through the GPIO set/clear registers.
+    """
+    TRAPEZOID = 'trapezoid'
+    SCURVE = 'scurve'
+
     FULL_ROTATION = int(4075.7728395061727 / 8)
 
     HALF_STEP = [
@@ -24,7 +62,8 @@ class Stepper:
         [1, 0, 0, 1]
     ]
     
-    def __init__(self, pin1, pin2, pin3, pin4, delay, mode=1):
+    def __init__(self, pin1, pin2, pin3, pin4, delay, mode=1, timer_id=0,
+                 max_hz=None, accel=None, profile=TRAPEZOID):
         if mode == 1:
             self.mode = self.FULL_STEP
         elif mode == 0:
@@ -37,22 +76,149 @@ class Stepper:
         self.pin3 = Pin(pin3, Pin.OUT)
         self.pin4 = Pin(pin4, Pin.OUT)
         self.delay = delay  # Recommend 10+ for FULL_STEP, 1 is OK for HALF_STEP
+
+        # Phase tables, built once so stepping allocates nothing: the coil
+        # bits of every phase (pin1 = bit 3), and the GPIO masks that switch
+        # all four coils with one clear and one set register write
+        self.phases = len(self.mode)
+        self.patterns = bytes(b[0] << 3 | b[1] << 2 | b[2] << 1 | b[3] for b in self.mode)
+        gpio = (pin1, pin2, pin3, pin4)
+        self.direct = GPIO_OUT_W1TS is not None and hasattr(machine, 'mem32') and all(isinstance(p, int) and p < 32 for p in gpio)
+        if self.direct:
+            self.coil_mask = (1 << pin1) | (1 << pin2) | (1 << pin3) | (1 << pin4)
+            self.set_masks = tuple(
+                sum(1 << p for p, on in zip(gpio, b) if on) for b in self.mode
+            )
+            self.clear_masks = tuple(self.coil_mask & ~m for m in self.set_masks)
+        self.coils = 0          # pattern currently on the coils
+
+        self.timer = Timer(timer_id)
+        self.running = False    # timer is armed
+        self.position = 0       # phases since power-on, + = forward
+        self.index = 0          # current entry of self.mode
+        self.moves = []         # queued moves in phases, sign = direction
+        self.direction = 1
+        self.total = 0          # phases in the current move
+        self.remaining = 0      # phases left in the current move
+        self.speed_limit = 0    # phases/s cap on the profile, 0 = none
+        self.callback = self._tick  # bound once, not on every re-arm
+        self.set_profile(max_hz, accel, profile)
         
         self.reset()
-        
-    def step(self, count, direction=1):
-        """Rotate count steps. direction = -1 means backwards"""
+
+    def set_profile(self, max_hz=None, accel=None, profile=TRAPEZOID):
+        """Speed profile in phases/s (accel in phases/s²); None = constant speed"""
+        start = 1000 // self.delay
+        ramp = [start]
+        if max_hz and accel and max_hz > start:
+            if profile == self.SCURVE:
+                # smoothstep speed over the ramp, long enough that its peak
+                # acceleration (mid-ramp) stays at accel
+                dv = max_hz - start
+                peak = 0
+                for i in range(51):
+                    x = i / 50
+                    peak = max(peak, (start + dv * x * x * (3 - 2 * x)) * dv * 6 * x * (1 - x))
+                n = int(peak / accel) + 1
+                for d in range(1, n):
+                    x = d / n
+                    ramp.append(int(start + dv * x * x * (3 - 2 * x)))
+            else:
+                # v² = v0² + 2·a·s
+                n = int((max_hz * max_hz - start * start) / (2 * accel)) + 1
+                for d in range(1, n):
+                    ramp.append(int(min(max_hz, (start * start + 2 * accel * d) ** 0.5)))
+            ramp.append(max_hz)
+        # ramp[d] = speed d phases away from the nearest end of a move
+        self.ramp = ramp
+
+    @property
+    def busy(self):
+        """True while a move is running or queued"""
+        return self.remaining > 0 or len(self.moves) > 0
+
+    def move(self, count, direction=1):
+        """Queue a move of count steps and return at once"""
         if count < 0:
             direction = -1
             count = -count
-        for x in range(count):
-            for bit in self.mode[::direction]:
-                self.pin1(bit[0])
-                self.pin2(bit[1])
-                self.pin3(bit[2])
-                self.pin4(bit[3])
-                time.sleep_ms(self.delay)
+        if count == 0:
+            return
+        self.moves.append(count * self.phases * direction)
+        if not self.running:
+            self.running = True
+            self.timer.init(mode=Timer.ONE_SHOT, freq=self.ramp[0], callback=self.callback)
+
+    @micropython.native
+    def _tick(self, timer):
+        """Timer callback: output the next phase, start the next queued move"""
+        if self.remaining == 0:
+            if not self.moves:
+                # Held the last phase for one period, now release the coils
+                self.timer.deinit()
+                self.running = False
+                self.reset()
+                return
+            phases = self.moves.pop(0)
+            self.direction = 1 if phases > 0 else -1
+            self.total = self.remaining = abs(phases)
+
+        index = (self.index + self.direction) % self.phases
+        self.index = index
+        if self.direct:
+            machine.mem32[GPIO_OUT_W1TC] = self.clear_masks[index]
+            machine.mem32[GPIO_OUT_W1TS] = self.set_masks[index]
+        else:
+            self._write(self.patterns[index])
+        self.position += self.direction
+        self.remaining -= 1
+
+        # Re-arm for the next phase: speed up away from the start, brake
+        # into the end. freq gives microsecond resolution where period= is ms.
+        d = min(self.total - self.remaining, self.remaining)
+        ramp = self.ramp
+        freq = ramp[d] if d < len(ramp) else ramp[-1]
+        if self.speed_limit and freq > self.speed_limit:
+            freq = self.speed_limit
+        self.timer.init(mode=Timer.ONE_SHOT, freq=freq, callback=self.callback)
+
+    def _write(self, pattern):
+        """Set the coils to pattern, touching only the pins that change"""
+        changed = pattern ^ self.coils
+        if changed & 8:
+            self.pin1(pattern >> 3 & 1)
+        if changed & 4:
+            self.pin2(pattern >> 2 & 1)
+        if changed & 2:
+            self.pin3(pattern >> 1 & 1)
+        if changed & 1:
+            self.pin4(pattern & 1)
+        self.coils = pattern
+
+    def progress(self):
+        """Fraction of the current move done (1.0 when idle)"""
+        if self.remaining == 0 or self.total == 0:
+            return 1.0
+        return 1 - self.remaining / self.total
+
+    def stop(self):
+        """Abort the current move and drop the queued ones"""
+        self.timer.deinit()
+        self.running = False
+        self.moves = []
+        self.remaining = 0
         self.reset()
+
+    async def wait(self, poll_ms=20):
+        """Wait until every queued move has finished or was stopped"""
+        while self.busy:
+            await asyncio.sleep_ms(poll_ms)
+        
+    def step(self, count, direction=1):
+        """Rotate count steps and wait for it. direction = -1 means backwards"""
+        self.move(count, direction)
+        while self.busy:
+            time.sleep_ms(self.delay)
     
     def angle(self, r, direction=1):
         """Rotate by angle (degrees)"""
@@ -60,7 +226,11 @@ class Stepper:
     
     def reset(self):
         """Reset all pins to 0"""
-        self.pin1(0) 
-        self.pin2(0) 
-        self.pin3(0) 
-        self.pin4(0)
+        if self.direct:
+            machine.mem32[GPIO_OUT_W1TC] = self.coil_mask
+        else:
+            self.pin1(0) 
+            self.pin2(0) 
+            self.pin3(0) 
+            self.pin4(0)
+        self.coils = 0
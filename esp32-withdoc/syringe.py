@@ -0,0 +1,75 @@
+import json
+import os
+
+
+class Syringe:
+    """Syringe plunger position, kept in flash so it survives a reboot.
+
+    Positions are stepper phases with 0 = syringe empty; pushing (a positive
+    move) dispenses, so the syringe holds -position / phases_per_ml ml.
+    """
+    def __init__(self, stepper, steps_per_ml, capacity_ml, path='position.json'):
+        self.stepper = stepper
+        self.phases_per_ml = steps_per_ml * stepper.phases
+        self.capacity_ml = capacity_ml
+        self.path = path
+        self.known = False  # position was restored or set, limits apply
+        self.saved = None   # position last written to flash
+        self.load()
+
+    def load(self):
+        """Restore the position saved at the last safe point"""
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            print("No saved syringe position, send set_volume to set it")
+            return
+        if state.get('moving'):
+            # Power was lost mid-move, the plunger could be anywhere
+            print("Syringe position lost during a move, send set_volume to set it")
+            return
+        self.stepper.position = state['position']
+        self.saved = state['position']
+        self.known = True
+        print(f"Syringe holds {self.volume_ml():.2f} ml")
+
+    def save(self, moving=False):
+        """Write the position to flash; moving=True marks it invalid until the next save"""
+        if not self.known or (not moving and self.saved == self.stepper.position):
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'position': self.stepper.position, 'moving': moving}, f)
+        os.rename(tmp, self.path)  # a power cut leaves the old file or the new one
+        self.saved = None if moving else self.stepper.position
+
+    def volume_ml(self):
+        """ml in the syringe, None if the position is unknown"""
+        if not self.known:
+            return None
+        return -self.stepper.position / self.phases_per_ml
+
+    def set_volume(self, ml):
+        """Declare how much the syringe holds right now (manual homing)"""
+        if not 0 <= ml <= self.capacity_ml:
+            raise ValueError(f"{ml} ml is outside 0-{self.capacity_ml} ml")
+        self.stepper.position = -round(ml * self.phases_per_ml)
+        self.known = True
+        self.save()
+
+    def check(self, ml_change):
+        """Raise ValueError if pushing ml_change (negative = drawing) would over-travel"""
+        if not self.known:
+            return
+        after = self.volume_ml() - ml_change
+        if after < -0.001 or after > self.capacity_ml + 0.001:
+            raise ValueError(f"would leave {after:.2f} ml, outside 0-{self.capacity_ml} ml")
+
+    def change_to(self, ml):
+        """ml to push (negative = draw) to reach an absolute volume"""
+        if not self.known:
+            raise ValueError("syringe position unknown, send set_volume first")
+        if not 0 <= ml <= self.capacity_ml:
+            raise ValueError(f"{ml} ml is outside 0-{self.capacity_ml} ml")
+        return self.volume_ml() - ml
@@ -0,0 +1,108 @@
+import struct
+from binascii import crc32
+
+
+# Frame layout (little-endian). Every frame starts with
+#   version << 4 | type u8, seq u8, table id u32, ticks_ms u32, body length u8
+# An INDEX body lists the sensors as (index u8, kind u8, name length u8, name);
+# the table id is the CRC32 of that body. A DATA body is (index u8, value i16)
+# records, decoded with the index table the header's table id names.
+VERSION = 1
+INDEX = 1
+DATA = 2
+HEADER = "<BBIIB"
+HEADER_SIZE = 11
+MAX_BODY = 250      # one ESP-NOW message
+RECORD = "<Bh"
+RECORD_SIZE = 3
+
+# Value kinds: how a value is turned into the int16 on the wire
+KIND_INT = 1        # sent as is, e.g. ADC counts
+KIND_CENTI = 2      # hundredths, e.g. °C
+KIND_BOOL = 3
+
+
+def kind_of(value):
+    if isinstance(value, bool):
+        return KIND_BOOL
+    if isinstance(value, int):
+        return KIND_INT
+    return KIND_CENTI
+
+
+class FrameEncoder:
+    """Packs sensor values into versioned binary telemetry frames.
+
+    Each sensor name gets a one-byte index the first time it is seen. The
+    names only travel in INDEX frames, sent before the first DATA frame,
+    whenever a sensor is added and every index_every_ms after that, so a
+    server that missed one catches up. Dict values are flattened into
+    "<name>.<key>" entries, which the decoder nests again.
+    """
+    def __init__(self, index_every_ms=60000):
+        self.index_every_ms = index_every_ms
+        self.sensors = {}       # name -> (index, kind)
+        self.table = b''
+        self.table_id = 0
+        self.seq = 0
+        self.index_sent = None  # ticks_ms of the last INDEX frame, None = due
+
+    def register(self, name, value):
+        entry = self.sensors.get(name)
+        if entry is None:
+            if len(self.sensors) == 256:
+                raise ValueError("too many sensors for one index table")
+            entry = (len(self.sensors), kind_of(value))
+            self.sensors[name] = entry
+            encoded = name.encode()
+            self.table += struct.pack("<BBB", entry[0], entry[1], len(encoded)) + encoded
+            self.table_id = crc32(self.table) & 0xffffffff
+            self.index_sent = None
+        return entry
+
+    def resend_index(self):
+        """Send the index table again before the next DATA frame"""
+        self.index_sent = None
+
+    def frame(self, kind, ticks_ms, body):
+        if len(body) > MAX_BODY:
+            raise ValueError("frame body too large")
+        self.seq = (self.seq + 1) & 0xff
+        return struct.pack(HEADER, VERSION << 4 | kind, self.seq, self.table_id,
+                           ticks_ms & 0xffffffff, len(body)) + body
+
+    def index(self, ticks_ms):
+        """The INDEX frame on its own, e.g. ahead of frames that were held back"""
+        self.index_sent = ticks_ms
+        return self.frame(INDEX, ticks_ms, self.table)
+
+    def clock(self, ticks_ms):
+        """An empty DATA frame that only carries the time. The server dates
+        the frames of a message back from its last one, so this goes after
+        frames that were held back."""
+        return self.frame(DATA, ticks_ms, b'')
+
+    def encode(self, values, ticks_ms):
+        """Frames for one set of values: a DATA frame, after an INDEX frame if one is due"""
+        records = []
+        for name, value in values.items():
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    records.append((self.register(name + "." + key, item), item))
+            elif value is not None:
+                records.append((self.register(name, value), value))
+
+        body = bytearray(len(records) * RECORD_SIZE)
+        for i, ((index, kind), value) in enumerate(records):
+            if kind == KIND_CENTI:
+                value = round(value * 100)
+            value = max(-32768, min(32767, int(value)))
+            struct.pack_into(RECORD, body, i * RECORD_SIZE, index, value)
+
+        frames = []
+        # abs(): after ticks_ms wraps around the difference goes negative
+        if self.index_sent is None or (self.index_every_ms and
+                abs(ticks_ms - self.index_sent) >= self.index_every_ms):
+            frames.append(self.index(ticks_ms))
+        frames.append(self.frame(DATA, ticks_ms, body))
+        return frames
@@ -0,0 +1 @@
+"""Host-side simulator for the ESP32 firmware (virtual clock + fake hardware)"""
@@ -0,0 +1,141 @@
+import heapq
+import time as _time
+
+_real_sleep = _time.sleep
+
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALF = TICKS_PERIOD // 2
+
+
+class SimulationEnd(BaseException):
+    """Raised when virtual time reaches the end of the run.
+
+    Derives from BaseException so firmware 'except Exception' blocks
+    do not swallow it.
+    """
+
+
+class Event:
+    """Handle for a scheduled callback"""
+    def __init__(self, due_us, callback):
+        self.due_us = due_us
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualClock:
+    """Microsecond virtual clock with scheduled events (timers, radio, broker)"""
+    def __init__(self, speed=0, until_us=None):
+        self.now_us = 0
+        self.speed = speed          # 0 = as fast as possible, 1 = real time, 10 = 10x
+        self.until_us = until_us
+        self._events = []
+        self._seq = 0
+        self._observers = []
+
+    def call_at(self, due_us, callback):
+        """Run callback when virtual time reaches due_us"""
+        event = Event(max(due_us, self.now_us), callback)
+        self._seq += 1
+        heapq.heappush(self._events, (event.due_us, self._seq, event))
+        return event
+
+    def call_later(self, delay_us, callback):
+        return self.call_at(self.now_us + delay_us, callback)
+
+    def on_advance(self, observer):
+        """observer(now_us, new_us) is called before time moves forward"""
+        self._observers.append(observer)
+
+    def next_due(self):
+        while self._events and self._events[0][2].cancelled:
+            heapq.heappop(self._events)
+        return self._events[0][0] if self._events else None
+
+    def _move_to(self, t_us):
+        if t_us <= self.now_us:
+            return
+        if self.until_us is not None and t_us > self.until_us:
+            t_us = self.until_us
+            end = True
+        else:
+            end = False
+        for observer in self._observers:
+            observer(self.now_us, t_us)
+        if self.speed:
+            _real_sleep((t_us - self.now_us) / 1e6 / self.speed)
+        self.now_us = t_us
+        if end:
+            raise SimulationEnd()
+
+    def _fire_due(self, limit_us):
+        while True:
+            due = self.next_due()
+            if due is None or due > limit_us:
+                return
+            _, _, event = heapq.heappop(self._events)
+            self._move_to(due)
+            event.callback()
+
+    def advance(self, us):
+        """Let us microseconds pass, firing every event that falls due"""
+        target = self.now_us + max(int(us), 0)
+        self._fire_due(target)
+        self._move_to(target)
+
+    def wait_for(self, predicate, timeout_us=None):
+        """Advance until predicate() is true or timeout_us passes; returns predicate()"""
+        deadline = None if timeout_us is None else self.now_us + int(timeout_us)
+        while not predicate():
+            due = self.next_due()
+            if due is None or (deadline is not None and due > deadline):
+                if deadline is None:
+                    raise SimulationEnd()   # nothing can ever wake us
+                self._move_to(deadline)
+                return predicate()
+            self._fire_due(due)
+        return True
+
+    # MicroPython time API
+
+    def ticks_ms(self):
+        return (self.now_us // 1000) & TICKS_MAX
+
+    def ticks_us(self):
+        return self.now_us & TICKS_MAX
+
+    def install(self, time_module=_time):
+        """Patch sleep/ticks functions of the time module onto this clock"""
+        saved = {name: getattr(time_module, name, None) for name in _PATCHED}
+        time_module.sleep = lambda s: self.advance(s * 1e6)
+        time_module.sleep_ms = lambda ms: self.advance(ms * 1000)
+        time_module.sleep_us = lambda us: self.advance(us)
+        time_module.ticks_ms = self.ticks_ms
+        time_module.ticks_us = self.ticks_us
+        time_module.ticks_cpu = self.ticks_us
+        time_module.ticks_add = ticks_add
+        time_module.ticks_diff = ticks_diff
+
+        def uninstall():
+            for name, value in saved.items():
+                if value is None:
+                    delattr(time_module, name)
+                else:
+                    setattr(time_module, name, value)
+        return uninstall
+
+
+_PATCHED = ("sleep", "sleep_ms", "sleep_us", "ticks_ms", "ticks_us", "ticks_cpu", "ticks_add", "ticks_diff")
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+
+def ticks_diff(end, start):
+    return ((end - start + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
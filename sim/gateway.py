@@ -0,0 +1,221 @@
+"""Run the ESP32-2 gateway on CPython against simulated ESP-NOW sensor nodes.
+
+    python sim/gateway.py --seconds 30 --nodes 10 --rate 20 --fanout
+
+Each node announces itself with HELLO:rack-<n>, sends --rate messages/s to
+the gateway and takes commands back. Reports what reached the broker, what
+was lost on the way and how long sensor messages and commands took.
+"""
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from sim.clock import SimulationEnd   # noqa: E402
+from sim.run import take_offline      # noqa: E402
+from sim.world import World           # noqa: E402
+
+MAGIC = b"SIM"
+TOPIC_SENSOR = b"esp32/sensors"
+TOPIC_COMMAND = b"esp32/command"
+START_US = 3000000
+
+
+class SensorNode:
+    """An ESP-NOW node sending fixed-size messages to the gateway"""
+    def __init__(self, world, index, gateway_mac, rate, size, start_us=0):
+        self.world = world
+        self.index = index
+        self.mac = b"\x24\x6f\x28\xaa\x00" + bytes([index])
+        self.gateway_mac = gateway_mac
+        self.interval_us = int(1e6 / rate)
+        self.size = max(size, 9)
+        self.seq = 0
+        self.sent = {}          # seq -> send time
+        self.commands = []      # (receive time, message)
+        world.air.attach(self)
+        world.clock.call_at(start_us - 500000, self._hello)
+        # Spread the nodes over the first interval so they don't all send at once
+        offset = world.random.randrange(self.interval_us)
+        world.clock.call_at(start_us + offset, self._send)
+
+    def _hello(self):
+        # Repeated until the gateway's radio acknowledges it, like a real node would
+        if not self.world.air.transmit(self.mac, self.gateway_mac, b"HELLO:rack-%d" % self.index):
+            self.world.clock.call_later(100000, self._hello)
+
+    def _send(self):
+        self.seq += 1
+        msg = MAGIC + struct.pack("<BI", self.index, self.seq)
+        msg += bytes(self.size - len(msg))
+        self.sent[self.seq] = self.world.clock.now_us
+        self.world.air.transmit(self.mac, self.gateway_mac, msg)
+        jitter = self.world.random.randrange(-self.interval_us // 10, self.interval_us // 10 + 1)
+        self.world.clock.call_later(self.interval_us + jitter, self._send)
+
+    def _receive(self, src, msg):
+        self.commands.append((self.world.clock.now_us, msg))
+
+
+def split_messages(payload):
+    """The node messages in one MQTT payload: a single message or a gateway batch"""
+    if payload.startswith(MAGIC):
+        return [payload]
+    messages = []
+    pos = 0
+    while pos + 7 <= len(payload):
+        size = payload[pos + 6]
+        messages.append(payload[pos + 7:pos + 7 + size])
+        pos += 7 + size
+    return messages
+
+
+def simulate_gateway(firmware="esp32-2/esp32_2_gateway.py", seconds=30, nodes=1, rate=5, size=20,
+                     command_every=1.0, fanout=False, loss=0.0, seed=0, quiet=True, outages=()):
+    """Run the gateway script for `seconds` of virtual time with `nodes` sensor nodes.
+
+    Nodes and commands start at 3 s, once the gateway is on Wi-Fi and
+    subscribed. A command is published on esp32/command every command_every
+    seconds: to every node on esp32/command/rack-<n> with fanout, otherwise
+    on esp32/command, whose peer is the first node. loss is the share of
+    radio frames that never arrive. outages is a list of (start s, end s)
+    the broker is unreachable for.
+    Returns the World with the statistics filled in.
+    """
+    world = World(seed=seed, seconds=seconds).activate()
+    world.wall_s = 0.0
+    world.air.loss = loss
+    take_offline(world, outages)
+    world.nodes = [SensorNode(world, i, world.mac, rate, size, START_US) for i in range(nodes)]
+    world.sensor_latency = world.stat("sensor_latency_us")
+    world.command_latency = world.stat("command_latency_us")
+    world.commands_received = 0
+    world.forwarded = 0
+    world.batches = 0
+    world.commands_sent = 0
+    commands = {}
+
+    def on_publish(now, topic, msg):
+        if topic == TOPIC_SENSOR:
+            world.batches += 1
+            for message in split_messages(msg):
+                if message.startswith(MAGIC) and len(message) >= 8:
+                    index, seq = struct.unpack_from("<BI", message, 3)
+                    sent = world.nodes[index].sent.pop(seq, None)
+                    if sent is not None:
+                        world.forwarded += 1
+                        world.sensor_latency.add(now - sent)
+        elif topic.startswith(TOPIC_COMMAND):
+            commands[msg] = now
+            world.commands_sent += 1
+    world.broker.hooks.append(on_publish)
+
+    def send_command(n=[0]):
+        for node in world.nodes if fanout else [None]:
+            n[0] += 1
+            topic = TOPIC_COMMAND + (b"/rack-%d" % node.index if node else b"")
+            world.broker.publish(topic, str(n[0]))
+        world.clock.call_later(int(command_every * 1e6), send_command)
+    world.clock.call_at(START_US, send_command)
+
+    stdout = sys.stdout
+    saved_path = list(sys.path)
+    cwd = os.getcwd()
+    source = os.path.join(ROOT, firmware)
+    # The gateway's own modules (spool.py) sit next to it; its files go in a temp dir
+    sys.path[:0] = [os.path.join(HERE, "modules"), os.path.dirname(source)]
+    for name in ("uasyncio", "uselect", "spool"):
+        sys.modules.pop(name, None)
+    os.chdir(tempfile.mkdtemp(prefix="sim-flash-"))
+    text = open(source, encoding="utf-8").read()
+    # Point the gateway's hard-coded peer at the first simulated node
+    text = text.replace("b'\\x24\\x6F\\x28\\xAA\\xBB\\xCC'", repr(world.nodes[0].mac) if nodes else "b'\\x00' * 6")
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    started = time.perf_counter()
+    try:
+        try:
+            exec(compile(text, source, "exec"), {"__name__": "__main__"})
+        except SimulationEnd:
+            pass
+        world.wall_s = time.perf_counter() - started
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        sys.path[:] = saved_path
+        os.chdir(cwd)
+        world.deactivate()
+
+    for node in world.nodes:
+        for received, msg in node.commands:
+            sent = commands.get(msg)
+            if sent is not None:
+                world.commands_received += 1
+                world.command_latency.add(received - sent)
+    return world
+
+
+def report(world, out=sys.stdout):
+    sim_s = world.clock.now_us / 1e6
+    print(f"Simulated {sim_s:.1f} s in {world.wall_s:.2f} s wall time "
+          f"({sim_s / max(world.wall_s, 1e-9):.0f}x)", file=out)
+    offered = sum(node.seq for node in world.nodes)
+    # Messages sent in the last second may still be on their way
+    in_flight = sum(1 for node in world.nodes for t in node.sent.values() if t > world.clock.now_us - 1e6)
+    lost = sum(len(node.sent) for node in world.nodes) - in_flight
+    print(f"Nodes: {len(world.nodes)}, {offered} messages sent ({offered / sim_s:.1f}/s)", file=out)
+    print(f"  forwarded {world.forwarded} ({world.forwarded / sim_s:.1f}/s), lost {lost}, "
+          f"in flight {in_flight}", file=out)
+    print(f"  {world.batches} MQTT messages on esp32/sensors "
+          f"({world.forwarded / max(world.batches, 1):.1f} node messages each)", file=out)
+    for name, stat in (("sensor latency", world.sensor_latency), ("command latency", world.command_latency)):
+        if stat.count:
+            print(f"  {name:<16} n={stat.count:<6} mean={stat.mean / 1000:8.1f} ms  "
+                  f"p99={stat.percentile(99) / 1000:8.1f} ms  max={stat.max / 1000:8.1f} ms", file=out)
+    print(f"  commands: {world.commands_received} of {world.commands_sent} delivered", file=out)
+    # How often the gateway loop ran: fewer wakeups means more time asleep
+    checks = sum(stat.count for name, stat in world.stats.items() if name.endswith("check_gap_us"))
+    polls = world.stats.get("poll_wait_us")
+    print(f"  gateway loop: {checks / sim_s:.1f} MQTT checks/s"
+          + (f", {polls.count / sim_s:.1f} poll wakeups/s" if polls else ""), file=out)
+    print("MQTT:", file=out)
+    for topic in sorted(world.broker.messages):
+        count = world.broker.messages[topic]
+        print(f"  {topic.decode():<32} {count:6} msgs  {count / sim_s:7.2f}/s  "
+              f"{world.broker.bytes[topic]:8} bytes", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ESP32-2 gateway against simulated sensor nodes")
+    parser.add_argument("--firmware", default="esp32-2/esp32_2_gateway.py", help="gateway script to run")
+    parser.add_argument("--seconds", type=float, default=30, help="virtual seconds to run")
+    parser.add_argument("--nodes", type=int, default=1, help="sensor nodes sending to the gateway")
+    parser.add_argument("--rate", type=float, default=5, help="messages/s per node")
+    parser.add_argument("--size", type=int, default=20, help="bytes per node message")
+    parser.add_argument("--command-every", type=float, default=1.0, help="seconds between commands")
+    parser.add_argument("--fanout", action="store_true", help="send each command to every node by name")
+    parser.add_argument("--loss", type=float, default=0.0, help="share of radio frames lost")
+    parser.add_argument("--outage", action="append", default=[], metavar="START:END",
+                        help="take the broker offline from START to END (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show the gateway's own output")
+    args = parser.parse_args()
+
+    outages = [tuple(float(t) for t in outage.split(":")) for outage in args.outage]
+    world = simulate_gateway(args.firmware, args.seconds, args.nodes, args.rate, args.size,
+                             args.command_every, args.fanout, args.loss, args.seed, quiet=not args.verbose,
+                             outages=outages)
+    report(world)
+
+
+if __name__ == "__main__":
+    main()
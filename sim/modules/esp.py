@@ -0,0 +1,5 @@
+"""Fake esp module"""
+
+
+def osdebug(level):
+    pass
@@ -0,0 +1,96 @@
+"""Fake ESP-NOW driver on the simulated radio medium"""
+from collections import deque
+
+from sim.world import current
+
+
+class ESPNow:
+    def __init__(self):
+        self.world = current()
+        self.mac = bytes(self.world.mac)
+        self.peers = {}
+        self.rxbuf = 526
+        self.timeout_ms = 300000
+        self._active = False
+        self._buffer = deque()
+        self._buffered = 0
+        self._irq = None
+        self._stats = [0, 0, 0, 0, 0]     # tx, tx responses, tx failures, rx, rx dropped
+
+    def active(self, flag=None):
+        if flag is not None:
+            self._active = bool(flag)
+            if self._active:
+                self.world.air.attach(self)
+            else:
+                self.world.air.detach(self)
+        return self._active
+
+    def config(self, rxbuf=None, timeout_ms=None, **kwargs):
+        if rxbuf is not None:
+            self.rxbuf = rxbuf
+        if timeout_ms is not None:
+            self.timeout_ms = timeout_ms
+
+    def add_peer(self, mac, *args, **kwargs):
+        mac = bytes(mac)
+        if mac in self.peers:
+            raise OSError(-12395, "ESP_ERR_ESPNOW_EXIST")
+        self.peers[mac] = args
+
+    def del_peer(self, mac):
+        self.peers.pop(bytes(mac), None)
+
+    def get_peers(self):
+        return tuple(self.peers)
+
+    def send(self, mac, msg=None, sync=True):
+        if msg is None:
+            msg, mac = mac, None
+        msg = msg.encode() if isinstance(msg, str) else bytes(msg)
+        targets = [bytes(mac)] if mac is not None else list(self.peers)
+        self.world.spend("espnow_send")
+        ok = True
+        for target in targets:
+            self._stats[0] += 1
+            if self.world.air.transmit(self.mac, target, msg):
+                self._stats[1] += 1
+            else:
+                self._stats[2] += 1
+                ok = False
+        return ok if sync else True
+
+    def any(self):
+        return bool(self._buffer)
+
+    def recv(self, timeout_ms=None):
+        if timeout_ms is None:
+            timeout_ms = self.timeout_ms
+        timeout_us = None if timeout_ms < 0 else timeout_ms * 1000
+        self.world.clock.wait_for(lambda: self._buffer, timeout_us)
+        if not self._buffer:
+            return [None, None]
+        mac, msg = self._buffer.popleft()
+        self._buffered -= len(msg)
+        return [mac, msg]
+
+    irecv = recv
+
+    def _poll_events(self):
+        return 0x001 if self._buffer else 0     # POLLIN
+
+    def irq(self, callback):
+        self._irq = callback
+
+    def stats(self):
+        return tuple(self._stats)
+
+    def _receive(self, src, msg):
+        if self._buffered + len(msg) > self.rxbuf:
+            self._stats[4] += 1
+            return
+        self._stats[3] += 1
+        self._buffer.append((src, msg))
+        self._buffered += len(msg)
+        if self._irq:
+            self._irq(self)
@@ -0,0 +1,138 @@
+"""Fake machine module: Pin, ADC and Timer on the simulated world"""
+from sim.world import current
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    OPEN_DRAIN = 7
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_RISING = 1
+    IRQ_FALLING = 2
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        if isinstance(id, Pin):
+            id = id.id
+        self.id = id
+        self.world = current()
+        self.world.pins.setdefault(id, 0)
+        if value is not None:
+            self.value(value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        if value is not None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v is None:
+            return self.world.pins[self.id]
+        self.world.write_pin(self.id, 1 if v else 0)
+
+    __call__ = value
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def __repr__(self):
+        return f"Pin({self.id})"
+
+
+class ADC:
+    ATTN_0DB = 0
+    ATTN_2_5DB = 1
+    ATTN_6DB = 2
+    ATTN_11DB = 3
+    WIDTH_9BIT = 0
+    WIDTH_10BIT = 1
+    WIDTH_11BIT = 2
+    WIDTH_12BIT = 3
+
+    def __init__(self, pin, atten=None):
+        self.pin = pin.id if isinstance(pin, Pin) else pin
+        self.world = current()
+        self.bits = 12
+
+    def atten(self, value):
+        pass
+
+    def width(self, value):
+        self.bits = 9 + value
+
+    def read(self):
+        return self.world.read_adc(self.pin) >> (12 - self.bits)
+
+    def read_u16(self):
+        return self.world.read_adc(self.pin) << 4
+
+
+class Timer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=-1, **kwargs):
+        self.world = current()
+        self._event = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode=PERIODIC, period=-1, freq=-1, callback=None):
+        self.deinit()
+        period_us = int(1e6 / freq) if freq > 0 else int(period * 1000)
+        clock = self.world.clock
+
+        def fire():
+            # Re-arm first so the callback may call deinit()
+            if mode == Timer.PERIODIC:
+                self._event = clock.call_later(period_us, fire)
+            else:
+                self._event = None
+            if callback:
+                callback(self)
+
+        self._event = clock.call_later(period_us, fire)
+
+    def deinit(self):
+        if self._event:
+            self._event.cancel()
+            self._event = None
+
+
+class _Mem32:
+    """Only the GPIO_OUT_W1TS / W1TC registers of a classic ESP32"""
+    GPIO_OUT_W1TS = 0x3FF44008
+    GPIO_OUT_W1TC = 0x3FF4400C
+
+    def __setitem__(self, address, value):
+        if address == self.GPIO_OUT_W1TS:
+            current().write_register(value, 1)
+        elif address == self.GPIO_OUT_W1TC:
+            current().write_register(value, 0)
+        else:
+            raise ValueError(f"register {address:#x} is not simulated")
+
+
+mem32 = _Mem32()
+
+
+def unique_id():
+    return current().mac
+
+
+def freq(hz=None):
+    return 240000000
+
+
+def disable_irq():
+    return 0
+
+
+def enable_irq(state=0):
+    pass
+
+
+def reset():
+    raise SystemExit("machine.reset()")
@@ -0,0 +1,21 @@
+"""Fake micropython module"""
+from sim.world import current
+
+
+def const(value):
+    return value
+
+
+def schedule(func, arg):
+    current().clock.call_later(0, lambda: func(arg))
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def native(func):
+    return func
+
+
+viper = native
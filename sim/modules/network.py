@@ -0,0 +1,40 @@
+"""Fake network module (station interface only)"""
+from sim.world import current
+
+STA_IF = 0
+AP_IF = 1
+
+
+class WLAN:
+    PM_NONE = 0
+    PM_PERFORMANCE = 1
+    PM_POWERSAVE = 2
+
+    def __init__(self, interface=STA_IF):
+        self.world = current()
+        self.mac = self.world.mac
+        self._active = False
+        self._connected_at = None
+
+    def active(self, flag=None):
+        if flag is not None:
+            self._active = bool(flag)
+        return self._active
+
+    def connect(self, ssid=None, key=None):
+        self._connected_at = self.world.clock.now_us + 1500000
+
+    def disconnect(self):
+        self._connected_at = None
+
+    def isconnected(self):
+        return (self._active and self.world.wifi and self._connected_at is not None
+                and self.world.clock.now_us >= self._connected_at)
+
+    def ifconfig(self):
+        return ("192.168.1.50", "255.255.255.0", "192.168.1.1", "192.168.1.1")
+
+    def config(self, *args, **kwargs):
+        if args and args[0] == "mac":
+            return self.mac
+        return None
@@ -0,0 +1,284 @@
+"""Fake uasyncio: the MicroPython scheduler subset, running on the virtual clock"""
+from collections import deque
+import heapq
+
+from sim.world import current
+
+
+class CancelledError(BaseException):
+    pass
+
+
+class TimeoutError(Exception):
+    pass
+
+
+class _Suspend:
+    """Yielded to the loop by the awaitables below"""
+    def __init__(self, sleep_us=None, waiters=None):
+        self.sleep_us = sleep_us
+        self.waiters = waiters
+
+    def __await__(self):
+        yield self
+
+
+class Task:
+    def __init__(self, coro):
+        self.coro = coro
+        self.waiters = []
+        self.data = None
+        self.exc = None
+        self._done = False
+        self._throw = None
+        self._token = 0
+
+    def done(self):
+        return self._done
+
+    def cancel(self):
+        if self._done:
+            return False
+        self._throw = CancelledError()
+        _loop().wake(self)
+        return True
+
+    def __await__(self):
+        if not self._done:
+            yield _Suspend(waiters=self.waiters)
+        if self.exc is not None:
+            raise self.exc
+        return self.data
+
+
+class Loop:
+    def __init__(self):
+        self.ready = deque()        # (token, task)
+        self.sleeping = []          # (due_us, seq, token, task)
+        self.seq = 0
+        self.current = None
+
+    def create_task(self, coro):
+        task = Task(coro)
+        self.ready.append((task._token, task))
+        return task
+
+    def wake(self, task):
+        task._token += 1
+        self.ready.append((task._token, task))
+
+    def _step(self, task):
+        self.current = task
+        try:
+            if task._throw is not None:
+                exc, task._throw = task._throw, None
+                suspend = task.coro.throw(exc)
+            else:
+                suspend = task.coro.send(None)
+        except StopIteration as e:
+            return self._finish(task, e.value, None)
+        except CancelledError as e:
+            return self._finish(task, None, e)
+        except Exception as e:
+            if not task.waiters:
+                print(f"Task exception wasn't retrieved: {e!r}")
+            return self._finish(task, None, e)
+        finally:
+            self.current = None
+
+        task._token += 1
+        token = task._token
+        if suspend is None:
+            self.ready.append((token, task))
+            return
+        if suspend.waiters is not None:
+            suspend.waiters.append((token, task))
+        if suspend.sleep_us is not None:
+            self.seq += 1
+            due = current().clock.now_us + max(0, int(suspend.sleep_us))
+            heapq.heappush(self.sleeping, (due, self.seq, token, task))
+
+    def _finish(self, task, data, exc):
+        task._done = True
+        task.data = data
+        task.exc = exc
+        _wake_all(task.waiters)
+
+    def run_until(self, task):
+        clock = current().clock
+        while not task._done:
+            if self.ready:
+                token, t = self.ready.popleft()
+                if token == t._token and not t._done:
+                    self._step(t)
+                continue
+
+            while self.sleeping and self.sleeping[0][2] != self.sleeping[0][3]._token:
+                heapq.heappop(self.sleeping)
+            due = self.sleeping[0][0] if self.sleeping else None
+            event = clock.next_due()
+            if due is None and event is None:
+                clock.wait_for(lambda: False)   # nothing left to run: ends the simulation
+            target = min(t for t in (due, event) if t is not None)
+            # Clock events (radio, broker, IRQs) may set flags that wake tasks
+            clock.advance(target - clock.now_us)
+            while self.sleeping and self.sleeping[0][0] <= clock.now_us:
+                _, _, token, t = heapq.heappop(self.sleeping)
+                if token == t._token:
+                    self.wake(t)
+        if task.exc is not None:
+            raise task.exc
+        return task.data
+
+    def run_forever(self):
+        self.run_until(self.create_task(_forever()))
+
+
+async def _forever():
+    while True:
+        await _Suspend(sleep_us=1 << 40)
+
+
+def _wake_all(waiters):
+    loop = _loop()
+    while waiters:
+        token, task = waiters.pop(0)
+        if token == task._token:
+            loop.wake(task)
+
+
+_state = {"loop": None}
+
+
+def _loop():
+    if _state["loop"] is None:
+        _state["loop"] = Loop()
+    return _state["loop"]
+
+
+def get_event_loop():
+    return _loop()
+
+
+def new_event_loop():
+    _state["loop"] = Loop()
+    return _state["loop"]
+
+
+def current_task():
+    return _loop().current
+
+
+def create_task(coro):
+    return _loop().create_task(coro)
+
+
+def run(coro):
+    loop = _loop()
+    return loop.run_until(loop.create_task(coro))
+
+
+def sleep_ms(ms):
+    return _Suspend(sleep_us=ms * 1000)
+
+
+def sleep(s):
+    return _Suspend(sleep_us=s * 1e6)
+
+
+async def wait_for_ms(aw, timeout_ms):
+    task = aw if isinstance(aw, Task) else create_task(aw)
+    if not task._done:
+        await _Suspend(sleep_us=timeout_ms * 1000, waiters=task.waiters)
+    if not task._done:
+        task.cancel()
+        raise TimeoutError()
+    if task.exc is not None:
+        raise task.exc
+    return task.data
+
+
+def wait_for(aw, timeout):
+    return wait_for_ms(aw, timeout * 1000)
+
+
+async def gather(*aws, return_exceptions=False):
+    tasks = [aw if isinstance(aw, Task) else create_task(aw) for aw in aws]
+    results = []
+    for task in tasks:
+        try:
+            results.append(await task)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
+
+class Event:
+    def __init__(self):
+        self.state = False
+        self.waiting = []
+
+    def is_set(self):
+        return self.state
+
+    def set(self):
+        self.state = True
+        _wake_all(self.waiting)
+
+    def clear(self):
+        self.state = False
+
+    async def wait(self):
+        if not self.state:
+            await _Suspend(waiters=self.waiting)
+        return True
+
+
+class ThreadSafeFlag:
+    """Event that can be set from an IRQ; wait() clears it"""
+    def __init__(self):
+        self.state = False
+        self.waiting = []
+
+    def set(self):
+        self.state = True
+        _wake_all(self.waiting)
+
+    def clear(self):
+        self.state = False
+
+    async def wait(self):
+        while not self.state:
+            await _Suspend(waiters=self.waiting)
+        self.state = False
+
+
+class Lock:
+    def __init__(self):
+        self.state = False
+        self.waiting = []
+
+    def locked(self):
+        return self.state
+
+    async def acquire(self):
+        while self.state:
+            await _Suspend(waiters=self.waiting)
+        self.state = True
+        return True
+
+    def release(self):
+        self.state = False
+        while self.waiting:
+            token, task = self.waiting.pop(0)
+            if token == task._token:
+                _loop().wake(task)
+                break
+
+    async def __aenter__(self):
+        return await self.acquire()
+
+    async def __aexit__(self, *args):
+        self.release()
@@ -0,0 +1,2 @@
+"""ubinascii is binascii on CPython"""
+from binascii import *  # noqa: F401,F403
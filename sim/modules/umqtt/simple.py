@@ -0,0 +1,104 @@
+"""Fake umqtt.simple client on the in-process broker"""
+from collections import deque
+
+from sim.world import current
+
+
+# How long lwIP keeps retrying an unanswered SYN before connect() gives up
+CONNECT_GIVE_UP_US = 18000000
+
+
+class MQTTException(Exception):
+    pass
+
+
+class _Socket:
+    """Stands in for the client's socket where it is polled"""
+    def __init__(self, client):
+        self.client = client
+
+    def _poll_events(self):
+        if not self.client.connected or not self.client._online():
+            return 0x010                        # POLLHUP
+        return 0x001 if self.client.inbox else 0   # POLLIN
+
+
+class MQTTClient:
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=0, ssl=False, ssl_params=None):
+        self.world = current()
+        self.client_id = client_id
+        self.server = server
+        self.cb = None
+        self.connected = False
+        self.sock = None
+        self.inbox = deque()
+        self.last_check_us = None
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        pass
+
+    def _online(self):
+        return self.world.broker.online and self.world.wifi
+
+    def _check(self):
+        if not self.connected or not self._online():
+            self.connected = False
+            raise OSError(104, "ECONNRESET")
+
+    def connect(self, clean_session=True, timeout=None):
+        self.world.spend("mqtt_connect")
+        if not self.world.wifi:
+            raise OSError(113, "EHOSTUNREACH")
+        if not self.world.broker.online:
+            # Nothing answers, so connect() blocks until the socket times out
+            self.world.clock.advance(int(timeout * 1000000) if timeout else CONNECT_GIVE_UP_US)
+            raise OSError(116, "ETIMEDOUT")
+        self.world.broker.detach(self)
+        self.connected = True
+        self.sock = _Socket(self)
+        return 0
+
+    def disconnect(self):
+        self.world.broker.detach(self)
+        self.connected = False
+
+    def ping(self):
+        self._check()
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self._check()
+        self.world.spend("mqtt_publish")
+        self.world.broker.publish(topic, msg, self)
+
+    def subscribe(self, topic, qos=0):
+        self._check()
+        self.world.broker.subscribe(self, topic)
+
+    def wait_msg(self):
+        self._check()
+        self.world.clock.wait_for(lambda: self.inbox or not self._online())
+        self._check()
+        return self._dispatch()
+
+    def check_msg(self):
+        self._check()
+        now = self.world.clock.now_us
+        if self.last_check_us is not None:
+            self.world.stat(f"{self.client_id}.check_gap_us").add(now - self.last_check_us)
+        self.last_check_us = now
+        self.world.spend("mqtt_check")
+        if self.inbox:
+            return self._dispatch()
+        return None
+
+    def _deliver(self, topic, msg, sent_us):
+        self.inbox.append((topic, msg, sent_us))
+
+    def _dispatch(self):
+        topic, msg, sent_us = self.inbox.popleft()
+        self.world.stat(f"{self.client_id}.delivery_us").add(self.world.clock.now_us - sent_us)
+        if self.cb:
+            self.cb(topic, msg)
@@ -0,0 +1,45 @@
+"""Fake uselect: poll() over the simulated sockets and ESP-NOW, on the virtual clock"""
+from sim.world import current
+
+POLLIN = 0x001
+POLLOUT = 0x004
+POLLERR = 0x008
+POLLHUP = 0x010
+
+
+class Poll:
+    def __init__(self):
+        self.entries = {}       # id(obj) -> [obj, eventmask]
+
+    def register(self, obj, eventmask=POLLIN | POLLOUT):
+        self.entries[id(obj)] = [obj, eventmask]
+
+    def unregister(self, obj):
+        self.entries.pop(id(obj), None)
+
+    def modify(self, obj, eventmask):
+        if id(obj) not in self.entries:
+            raise OSError(2, "ENOENT")
+        self.entries[id(obj)][1] = eventmask
+
+    def _ready(self):
+        ready = []
+        for obj, mask in self.entries.values():
+            # Errors and hang-ups are always reported, like on the board
+            events = obj._poll_events() & (mask | POLLERR | POLLHUP)
+            if events:
+                ready.append((obj, events))
+        return ready
+
+    def poll(self, timeout=-1):
+        world = current()
+        started = world.clock.now_us
+        world.clock.wait_for(self._ready, None if timeout < 0 else timeout * 1000)
+        world.stat("poll_wait_us").add(world.clock.now_us - started)
+        return self._ready()
+
+    ipoll = poll
+
+
+def poll():
+    return Poll()
@@ -0,0 +1,186 @@
+"""Run the ESP32 firmware on CPython against the simulated world and report timings.
+
+    python sim/run.py --seconds 60 --command '{"ml": 2}' --at 5
+"""
+import argparse
+import os
+import struct
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from sim.clock import SimulationEnd   # noqa: E402
+from sim.world import World           # noqa: E402
+
+# Reloaded for every run so no state leaks between simulations
+FIRMWARE_MODULES = ("boot", "config", "main", "sensors", "stepper", "syringe", "telemetry", "spool",
+                    "gateway", "uasyncio")
+TELEMETRY_TOPIC = b"liquid_system/telemetry"
+FRAME_HEADER = struct.Struct("<BBIIB")     # esp32-1/telemetry.py
+FRAME_DATA = 2
+
+
+def load_firmware(firmware):
+    """Put the fake MicroPython modules and the firmware directory on sys.path"""
+    path = os.path.join(ROOT, firmware)
+    if not os.path.isdir(path):
+        raise ValueError(f"no firmware directory {path}")
+    for name in FIRMWARE_MODULES:
+        sys.modules.pop(name, None)
+    # The board stepper.py picks its GPIO registers for; the fake mem32 is a classic ESP32's
+    sys.implementation._machine = "Generic ESP32 module with ESP32"
+    for entry in (os.path.join(HERE, "modules"), path):
+        if entry in sys.path:
+            sys.path.remove(entry)
+        sys.path.insert(0, entry)
+
+
+def telemetry_frames(payload):
+    """(type, ticks_ms, body length) of each frame in a telemetry message"""
+    pos = 0
+    while pos + FRAME_HEADER.size <= len(payload):
+        version_kind, _, _, ticks, length = FRAME_HEADER.unpack_from(payload, pos)
+        yield version_kind & 0x0f, ticks, length
+        pos += FRAME_HEADER.size + length
+
+
+def take_offline(world, outages):
+    """Take the broker down for each (start s, end s)"""
+    def set_online(flag):
+        world.broker.online = flag
+    for start, end in outages:
+        world.clock.call_at(int(start * 1e6), lambda: set_online(False))
+        world.clock.call_at(int(end * 1e6), lambda: set_online(True))
+
+
+def simulate(firmware="esp32-1", seconds=60, speed=0, commands=(), seed=0, quiet=True, flash=None,
+             flow_scale=1.0, outages=()):
+    """Run LiquidDispensationSystem for `seconds` of virtual time.
+
+    commands is a list of (at_seconds, payload) published to the command topic.
+    flash is the directory the firmware sees as its filesystem (a fresh temp
+    directory if None); reuse it to simulate a reboot.
+    flow_scale is how much liquid really arrives per ml of plunger travel.
+    outages is a list of (start s, end s) the broker is unreachable for.
+    Returns the World with all recorded statistics.
+    """
+    world = World(seed=seed, speed=speed, seconds=seconds).activate()
+    world.flow_scale = flow_scale
+    world.commands = []
+    world.delivered = []
+    world.wall_s = 0.0
+    world.samples = []              # device ticks_ms of every DATA frame that arrived
+    take_offline(world, outages)
+
+    def on_publish(now, topic, msg):
+        if topic == TELEMETRY_TOPIC:
+            world.samples.extend(ticks for kind, ticks, length in telemetry_frames(msg)
+                                 if kind == FRAME_DATA and length)
+    world.broker.hooks.append(on_publish)
+    stdout = sys.stdout
+    cwd = os.getcwd()
+    os.chdir(flash or tempfile.mkdtemp(prefix="sim-flash-"))
+    try:
+        load_firmware(firmware)
+        import config
+        import main
+
+        def publish(payload):
+            world.commands.append(world.clock.now_us)
+            world.delivered.append(world.delivered_ml())
+            world.broker.publish(config.MQTT_TOPIC_COMMAND, payload)
+
+        for at, payload in commands:
+            world.clock.call_at(int(at * 1e6), lambda p=payload: publish(p))
+
+        if quiet:
+            sys.stdout = open(os.devnull, "w")
+        started = time.perf_counter()
+        try:
+            system = main.LiquidDispensationSystem(config.MQTT_BROKER, config.MQTT_CLIENT_ID)
+            if not system.init_components():
+                raise RuntimeError("firmware failed to initialise its components")
+            system.run()
+        except SimulationEnd:
+            pass
+        world.wall_s = time.perf_counter() - started
+    finally:
+        if sys.stdout is not stdout:
+            sys.stdout.close()
+            sys.stdout = stdout
+        world.deactivate()
+        os.chdir(cwd)
+    return world
+
+
+def report(world, out=sys.stdout):
+    sim_s = world.clock.now_us / 1e6
+    print(f"Simulated {sim_s:.1f} s in {world.wall_s:.2f} s wall time "
+          f"({sim_s / max(world.wall_s, 1e-9):.0f}x)", file=out)
+
+    for name, stat in sorted(world.stats.items()):
+        if name.endswith("_us") and stat.count:
+            print(f"  {name:<40} n={stat.count:<6} mean={stat.mean / 1000:8.1f} ms  "
+                  f"p99={stat.percentile(99) / 1000:8.1f} ms  max={stat.max / 1000:8.1f} ms", file=out)
+
+    moves = world.motor.moves
+    print(f"Motor: {len(moves)} moves, position {world.motor.position} half-steps "
+          f"({world.dispensed_ml():.2f} ml), {world.motor.lost} half-steps lost", file=out)
+    for i, sent_us in enumerate(world.commands):
+        next_us = world.commands[i + 1] if i + 1 < len(world.commands) else float("inf")
+        after = [m for m in moves if sent_us <= m[0] < next_us]
+        if not after:
+            print(f"  command {i + 1} at {sent_us / 1e6:.1f} s: motor never moved", file=out)
+        else:
+            delivered = (world.delivered[i + 1] if i + 1 < len(world.delivered)
+                         else world.delivered_ml()) - world.delivered[i]
+            print(f"  command {i + 1} at {sent_us / 1e6:.1f} s: motor started after "
+                  f"{(after[0][0] - sent_us) / 1000:.1f} ms, ran {(after[-1][1] - after[0][0]) / 1000:.0f} ms "
+                  f"for {sum(m[2] for m in after)} half-steps in {len(after)} moves, "
+                  f"{delivered:.2f} ml delivered", file=out)
+
+    if world.samples:
+        ticks = sorted(world.samples)
+        gap = max((b - a for a, b in zip(ticks, ticks[1:])), default=0)
+        print(f"Telemetry: {len(ticks)} samples arrived, longest gap {gap / 1000:.1f} s", file=out)
+
+    print("MQTT:", file=out)
+    for topic in sorted(world.broker.messages):
+        count = world.broker.messages[topic]
+        print(f"  {topic.decode():<32} {count:6} msgs  {count / sim_s:7.2f}/s  "
+              f"{world.broker.bytes[topic]:8} bytes", file=out)
+    print(f"Pin writes: {world.pin_writes}, GPIO register writes: {world.register_writes}", file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the ESP32 firmware against simulated hardware")
+    parser.add_argument("--firmware", default="esp32-1", help="firmware directory (esp32-1 or esp32-withdoc)")
+    parser.add_argument("--seconds", type=float, default=60, help="virtual seconds to run")
+    parser.add_argument("--speed", type=float, default=0, help="0 = as fast as possible, 1 = real time")
+    parser.add_argument("--command", action="append", default=[], help="payload to send on the command topic")
+    parser.add_argument("--at", action="append", type=float, default=[], help="when to send each --command (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flow-scale", type=float, default=1.0,
+                        help="ml that really arrive per ml of plunger travel (e.g. 0.9 for slack)")
+    parser.add_argument("--flash", help="directory used as the device filesystem (kept between runs)")
+    parser.add_argument("--outage", action="append", default=[], metavar="START:END",
+                        help="take the broker offline from START to END (s)")
+    parser.add_argument("--verbose", action="store_true", help="show the firmware's own output")
+    args = parser.parse_args()
+
+    times = args.at + [5.0 + 10 * i for i in range(len(args.at), len(args.command))]
+    outages = [tuple(float(t) for t in outage.split(":")) for outage in args.outage]
+    world = simulate(args.firmware, args.seconds, args.speed, list(zip(times, args.command)),
+                     args.seed, quiet=not args.verbose, flash=args.flash, flow_scale=args.flow_scale,
+                     outages=outages)
+    report(world)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+import math
+import random
+from collections import deque
+
+from sim.clock import VirtualClock
+
+
+# Virtual time charged for each hardware operation, in microseconds
+COSTS_US = {
+    "pin_write": 2,
+    "reg_write": 1,
+    "adc_read": 40,
+    "onewire_convert": 1000,
+    "onewire_read": 6000,
+    "mqtt_connect": 50000,
+    "mqtt_check": 100,
+    "mqtt_publish": 1500,
+    "espnow_send": 600,
+}
+
+BROADCAST = b"\xff" * 6
+
+_current = None
+
+
+def current():
+    """The world the fake hardware modules talk to"""
+    if _current is None:
+        raise RuntimeError("no simulated world is active, call World(...).activate() first")
+    return _current
+
+
+class Stat:
+    """Running count/total/min/max that keeps the samples for percentiles"""
+    def __init__(self, keep=100000):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.values = deque(maxlen=keep)
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.values.append(value)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, p):
+        if not self.values:
+            return 0
+        ordered = sorted(self.values)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+
+def topic_matches(pattern, topic):
+    parts = pattern.split(b"/")
+    names = topic.split(b"/")
+    for i, part in enumerate(parts):
+        if part == b"#":
+            return True
+        if i >= len(names) or (part != b"+" and part != names[i]):
+            return False
+    return len(parts) == len(names)
+
+
+def as_bytes(value):
+    return value.encode() if isinstance(value, str) else bytes(value)
+
+
+class Broker:
+    """In-process MQTT broker shared by every simulated client"""
+    def __init__(self, world, latency_us=2000):
+        self.world = world
+        self.latency_us = latency_us
+        self.online = True
+        self.subscriptions = []     # (pattern, client)
+        self.messages = {}          # topic -> count
+        self.bytes = {}             # topic -> payload bytes
+        self.hooks = []             # hook(now_us, topic, msg) for every publish
+
+    def subscribe(self, client, pattern):
+        self.subscriptions.append((as_bytes(pattern), client))
+
+    def detach(self, client):
+        self.subscriptions = [(p, c) for p, c in self.subscriptions if c is not client]
+
+    def publish(self, topic, msg, sender=None):
+        topic = as_bytes(topic)
+        msg = as_bytes(msg)
+        self.messages[topic] = self.messages.get(topic, 0) + 1
+        self.bytes[topic] = self.bytes.get(topic, 0) + len(msg)
+        now = self.world.clock.now_us
+        for hook in self.hooks:
+            hook(now, topic, msg)
+
+        for pattern, client in self.subscriptions:
+            if client is not sender and topic_matches(pattern, topic):
+                self.world.clock.call_later(
+                    self.latency_us,
+                    lambda c=client: c._deliver(topic, msg, now)
+                )
+
+
+class Air:
+    """ESP-NOW radio medium connecting the simulated boards by MAC"""
+    def __init__(self, world, latency_us=1000, loss=0.0):
+        self.world = world
+        self.latency_us = latency_us
+        self.loss = loss
+        self.nodes = {}
+
+    def attach(self, node):
+        self.nodes[node.mac] = node
+
+    def detach(self, node):
+        if self.nodes.get(node.mac) is node:
+            del self.nodes[node.mac]
+
+    def transmit(self, src, dst, msg):
+        """Returns True if a receiver acknowledged the frame"""
+        if dst == BROADCAST:
+            targets = [n for mac, n in self.nodes.items() if mac != src]
+        else:
+            targets = [self.nodes[dst]] if dst in self.nodes else []
+
+        delivered = False
+        for node in targets:
+            if self.world.random.random() < self.loss:
+                continue
+            self.world.clock.call_later(self.latency_us, lambda n=node: n._receive(src, msg))
+            delivered = True
+        return delivered
+
+
+class StepperMotor:
+    """28BYJ-48 + ULN2003 model.
+
+    Decodes the coil pattern on the four driver pins into a half-step rotor
+    position. A phase has to be held for dwell_us to count, and steps that
+    come faster than the motor can follow at its current speed are lost.
+    """
+    # Coil patterns of Stepper.HALF_STEP, pin1 as the high bit
+    PHASES = [0b0001, 0b0011, 0b0010, 0b0110, 0b0100, 0b1100, 0b1000, 0b1001]
+
+    def __init__(self, world, pins, pull_in_rate=1000, max_rate=1800, accel=4000, dwell_us=50):
+        self.world = world
+        self.pins = pins
+        self.pull_in_rate = pull_in_rate    # half-steps/s it can start at from standstill
+        self.max_rate = max_rate            # half-steps/s at full speed
+        self.accel = accel                  # half-steps/s^2 it can speed up by
+        self.dwell_us = dwell_us
+        self.position = 0                   # half-steps, + = push
+        self.phase = None
+        self.lost = 0
+        self.moves = []                     # [start_us, end_us, half-steps] per movement
+        self._seen = None
+        self._seen_since = 0
+        self._settled = True
+        self._last_step_us = None
+        self._moving_since = None
+        world.clock.on_advance(self._observe)
+
+    def pattern(self):
+        pins = self.world.pins
+        value = 0
+        for pin in self.pins:
+            value = (value << 1) | pins.get(pin, 0)
+        return value
+
+    def _observe(self, now_us, new_us):
+        pattern = self.pattern()
+        if pattern != self._seen:
+            self._seen = pattern
+            self._seen_since = now_us
+            self._settled = False
+        # Each coil pattern acts once, as soon as it has been held for dwell_us
+        if not self._settled and new_us - self._seen_since >= self.dwell_us and pattern in self.PHASES:
+            self._settled = True
+            self._apply(self.PHASES.index(pattern), self._seen_since + self.dwell_us)
+
+    def _apply(self, phase, t_us):
+        if self.phase is None:
+            self.phase = phase
+            return
+        delta = (phase - self.phase + 4) % 8 - 4
+        if delta == 0:
+            return
+
+        idle = self._last_step_us is None or t_us - self._last_step_us > 2e6 / self.pull_in_rate
+        if idle:
+            self._moving_since = t_us
+            rate = self.pull_in_rate
+        else:
+            moving_s = (t_us - self._moving_since) / 1e6
+            rate = min(self.max_rate, self.pull_in_rate + self.accel * moving_s)
+            if (t_us - self._last_step_us) < 1e6 / rate * 0.999 or abs(delta) > 2:
+                self.lost += 1               # this phase was not followed
+                self._moving_since = t_us   # stalled, has to start again
+                self._last_step_us = t_us
+                return
+
+        self.phase = phase
+        self.position += delta
+        if idle or not self.moves:
+            self.moves.append([t_us, t_us, 0])
+        self.moves[-1][1] = t_us
+        self.moves[-1][2] += delta
+        self._last_step_us = t_us
+
+
+class World:
+    """Everything outside the firmware: clock, pins, sensors, radio and broker"""
+    def __init__(self, seed=0, speed=0, seconds=None, mac=b"\x24\x6f\x28\x11\x22\x33",
+                 stepper_pins=(16, 17, 5, 18), level_pin=32, laser_pin=34):
+        self.clock = VirtualClock(speed, None if seconds is None else int(seconds * 1e6))
+        self.random = random.Random(seed)
+        self.mac = mac
+        self.wifi = True
+        self.pins = {}
+        self.pin_writes = 0
+        self.register_writes = 0
+        self.broker = Broker(self)
+        self.air = Air(self)
+        self.motor = StepperMotor(self, stepper_pins)
+        self.stats = {}
+
+        # Syringe and container: 1 ml per STEPS_PER_ML (170) steps of 8 phases
+        self.halfsteps_per_ml = 170 * 8
+        self.flow_scale = 1.0               # ml that really arrive per ml of plunger travel
+        self.level_ml = 0.0
+        self.flow_tau_s = 0.3               # liquid reaches the sensor with this lag
+        self.level_counts_per_ml = 50
+        self.level_base = 1500
+        self.level_noise = 15
+        self.laser_level_ml = 25.0          # beam is broken above this level
+        self._level_updated_us = 0
+
+        self.adc_sources = {level_pin: self.level_adc, laser_pin: self.laser_adc}
+        self.ds_roms = [bytearray(b"(\xff\x1a\x2b\x3c\x4d\x5e\x01")]
+        self.ds_conversion_us = 750000
+
+        self._uninstall = None
+
+    # Lifecycle
+
+    def activate(self):
+        global _current
+        _current = self
+        self._uninstall = self.clock.install()
+        return self
+
+    def deactivate(self):
+        global _current
+        if self._uninstall:
+            self._uninstall()
+            self._uninstall = None
+        if _current is self:
+            _current = None
+
+    def spend(self, what):
+        self.clock.advance(COSTS_US[what])
+
+    def stat(self, name):
+        if name not in self.stats:
+            self.stats[name] = Stat()
+        return self.stats[name]
+
+    # Pins and analog inputs
+
+    def write_pin(self, pin, value):
+        self.pins[pin] = value
+        self.pin_writes += 1
+        self.spend("pin_write")
+
+    def write_register(self, mask, value):
+        """A GPIO set/clear register write: every pin in mask changes at once"""
+        pin = 0
+        while mask:
+            if mask & 1:
+                self.pins[pin] = value
+            mask >>= 1
+            pin += 1
+        self.register_writes += 1
+        self.spend("reg_write")
+
+    def read_adc(self, pin):
+        self.spend("adc_read")
+        source = self.adc_sources.get(pin)
+        value = source() if source else 0
+        return max(0, min(4095, int(value)))
+
+    def dispensed_ml(self):
+        return self.motor.position / self.halfsteps_per_ml
+
+    def delivered_ml(self):
+        """Liquid that has left the syringe (the level settles to this)"""
+        return self.dispensed_ml() * self.flow_scale
+
+    def _update_level(self):
+        now = self.clock.now_us
+        dt = (now - self._level_updated_us) / 1e6
+        self._level_updated_us = now
+        target = self.delivered_ml()
+        self.level_ml += (target - self.level_ml) * (1 - math.exp(-dt / self.flow_tau_s))
+
+    def level_adc(self):
+        self._update_level()
+        noise = self.random.gauss(0, self.level_noise)
+        if self.random.random() < 0.01:
+            noise += self.random.choice((-1, 1)) * 400    # occasional ADC spike
+        return self.level_base + self.level_ml * self.level_counts_per_ml + noise
+
+    def laser_adc(self):
+        self._update_level()
+        if self.level_ml >= self.laser_level_ml:
+            return 4095
+        return 3000 + self.random.gauss(0, 60)
+
+    def temperature(self, rom):
+        t = self.clock.now_us / 1e6
+        return round(21.5 + 0.5 * math.sin(t / 600) + self.random.gauss(0, 0.05), 4)